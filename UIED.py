@@ -1,17 +1,22 @@
 import re
 
 import cv2
-import os
 import numpy as np
 from appium import webdriver
 from appium.options.ios import XCUITestOptions
 from ultralytics import YOLO
 
 from detect_compo import ip_region_proposal as detect_compo
+import detect_compo.lib_ip.file_utils as file
+from utils.screen_cache import default_cache
 
 # Initialize YOLOv8 model
 model = YOLO()
 
+# Detection results of known screens are reused from the cache
+screen_cache = default_cache()
+key_params = {'min-grad': 10, 'ffl-block': 5, 'min-ele-area': 50, 'merge-contained-ele': True}
+
 # Set up Appium driver
 options = XCUITestOptions()
 options.set_capability("platformName", "iOS")
@@ -42,27 +47,23 @@ def preprocess_image(image):
 
 
 def detect_objects(image):
-    results = model(image)
-    return results[0].boxes.data.cpu().numpy()
+    def detect(img):
+        results = model(img)
+        return results[0].boxes.data.cpu().numpy()
+    return screen_cache.get_or_detect(image, detect, tag='yolo')
 
 
 def detect_ui_elements(image):
-    # Save the image temporarily
-    temp_image_path = 'temp_screenshot.png'
-    cv2.imwrite(temp_image_path, image)
-
-    # Detect UI components and text
-    output_root = 'output'
-    compos = detect_compo.compo_detection(temp_image_path, output_root)
-    # texts = detect_text(temp_image_path, output_root)
-
-    # Combine components and texts
-    elements = compos  # + texts
-
-    # Clean up temporary files
-    os.remove(temp_image_path)
-
-    return elements
+    def detect(img):
+        # Detect UI components and text straight from the decoded pixels
+        output_root = 'output'
+        compos = detect_compo.compo_detection(img, output_root, key_params, name='screenshot')
+        # texts = detect_text(img, output_root)
+
+        # Combine components and texts
+        elements = file.wrap_corners(compos)['compos']  # + texts
+        return elements
+    return screen_cache.get_or_detect(image, detect, tag='uied')
 
 
 def parse_command(command):
@@ -1,5 +1,7 @@
 import cv2
+import os
 from os.path import join as pjoin
+from concurrent.futures import ThreadPoolExecutor
 import time
 import json
 import numpy as np
@@ -9,22 +11,187 @@ import detect_compo.lib_ip.ip_draw as draw
 import detect_compo.lib_ip.ip_detection as det
 import detect_compo.lib_ip.file_utils as file
 import detect_compo.lib_ip.Component as Compo
+from detect_compo.lib_ip.Bbox import Bbox
 from config.CONFIG_UIED import Config
+from utils.render import should_render
+from utils.profiling import profile_stage, profile_count, start_capture, finish_capture
 C = Config()
 
+# traced bytes per pixel of the working image at the peak of the detection beyond the image itself, the maximum
+# over the sample screens with and without the pixels of the components kept; the peak is mostly transient arrays,
+# dropping the pixels mainly shrinks the memory the results hold on to
+PIXEL_BYTES = 20
+PIXEL_BYTES_NO_REGION = 18
 
-def nesting_inspection(org, grey, compos, ffl_block):
+
+def merge_regions(regions):
+    '''
+    Merge overlapping or touching regions until they are all disjoint
+    :param regions: list of Bbox
+    '''
+    changed = True
+    while changed:
+        changed = False
+        temp_set = []
+        for region_a in regions:
+            merged = False
+            for i, region_b in enumerate(temp_set):
+                if region_a.col_min <= region_b.col_max and region_b.col_min <= region_a.col_max and \
+                        region_a.row_min <= region_b.row_max and region_b.row_min <= region_a.row_max:
+                    temp_set[i] = region_b.bbox_merge(region_a)
+                    merged = True
+                    changed = True
+                    break
+            if not merged:
+                temp_set.append(region_a)
+        regions = temp_set
+    return regions
+
+
+def coarse_region_proposal(org, grad_min, coarse_height, pad=4, min_area=4):
+    '''
+    Locate the regions holding elements through a fast pass over a low-resolution copy of the image
+    :param coarse_height: height of the low-resolution copy
+    :param pad: padding around each region, in the coordinates of org
+    :param min_area: minimum area of a region in the low-resolution copy
+    :return: regions: disjoint candidate regions [Bbox] in the coordinates of org
+             line_rows: [(row_start, row_end)] rows of org covered by the lines removed in the low-resolution copy
+    '''
+    height, width = org.shape[:2]
+    coarse_width = max(int(round(width * coarse_height / height)), 1)
+    scale_row, scale_col = height / coarse_height, width / coarse_width
+    coarse = cv2.resize(org, (coarse_width, coarse_height), interpolation=cv2.INTER_AREA)
+
+    # area interpolation keeps at least half of the gradient of a step edge
+    binary = pre.binarization(coarse, grad_min=max(grad_min // 2, 1))
+    filled_rows = binary.any(axis=1)
+    det.rm_line(binary)
+    line_rows = [(int(r * scale_row), min(int(np.ceil((r + 1) * scale_row)), height))
+                 for r in np.flatnonzero(filled_rows & ~binary.any(axis=1))]
+
+    # connected areas of the slightly dilated binary map are the candidate regions
+    _, _, stats, _ = cv2.connectedComponentsWithStats(cv2.dilate(binary, np.ones((3, 3), dtype=np.uint8)), connectivity=8)
+    regions = []
+    for col, row, w, h, area in stats[1:]:
+        if area < min_area:
+            continue
+        regions.append(Bbox(max(int(col * scale_col) - pad, 0),
+                            max(int(row * scale_row) - pad, 0),
+                            min(int(np.ceil((col + w) * scale_col)) + pad, width),
+                            min(int(np.ceil((row + h) * scale_row)) + pad, height)))
+    return merge_regions(regions), line_rows
+
+
+def coarse_to_fine_detection(org, uied_params, coarse_height, keep_region=True):
+    '''
+    Run the binarization and component detection at full resolution only inside the candidate regions
+    found by the low-resolution pass
+    :param keep_region: if False, the components do not keep their pixels
+    :return: binary: binary map of org, blank outside the candidate regions
+             compos: components in the coordinates of org
+    '''
+    grad_min = int(uied_params['min-grad'])
+    regions, line_rows = coarse_region_proposal(org, grad_min, coarse_height)
+
+    binary = np.zeros(org.shape[:2], dtype=np.uint8)
+    for region in regions:
+        col_min, row_min, col_max, row_max = region.put_bbox()
+        binary[row_min:row_max, col_min:col_max] = pre.binarization(org[row_min:row_max, col_min:col_max], grad_min=grad_min)
+    for row_start, row_end in line_rows:
+        binary[row_start:row_end] = 0
+
+    compos = []
+    for region in regions:
+        col_min, row_min, col_max, row_max = region.put_bbox()
+        region_compos = det.component_detection(binary[row_min:row_max, col_min:col_max], min_obj_area=int(uied_params['min-ele-area']),
+                                                keep_region=keep_region)
+        Compo.cvt_compos_relative_pos(region_compos, col_min, row_min)
+        compos += region_compos
+    return binary, compos
+
+
+def strip_detection(org, uied_params, strip_height, overlap=40, workers=1, keep_region=True):
+    '''
+    Detect components strip by strip so the working arrays are bounded by the strip size rather than the page size
+    Every strip extends into the next one by the overlap, and components cut by the strip borders are stitched back
+    :param strip_height: height of each strip
+    :param overlap: rows shared by consecutive strips
+    :param workers: number of strips processed in parallel
+    :param keep_region: if False, the components do not keep their pixels
+    :return: components in the coordinates of org
+    '''
+    height = org.shape[0]
+    grad_min, min_area = int(uied_params['min-grad']), int(uied_params['min-ele-area'])
+
+    def detect_strip(row_start):
+        row_end = min(row_start + strip_height + overlap, height)
+        binary = pre.binarization(org[row_start:row_end], grad_min=grad_min)
+        det.rm_line(binary)
+        compos = det.component_detection(binary, min_obj_area=min_area, keep_region=keep_region)
+        Compo.cvt_compos_relative_pos(compos, 0, row_start)
+        return compos
+
+    starts = list(range(0, height, strip_height))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            strips_compos = list(executor.map(detect_strip, starts))
+    else:
+        strips_compos = [detect_strip(row_start) for row_start in starts]
+
+    compos = []
+    for row_start, strip_compos in zip(starts, strips_compos):
+        core_end = row_start + strip_height
+        # components reaching into this strip from the previous ones
+        open_compos = [compo for compo in compos if compo.bbox.row_max >= row_start]
+        for compo in strip_compos:
+            # components starting in the overlap belong to the next strip
+            if compo.bbox.row_min >= core_end:
+                continue
+            # components cut by the top border continue an open component of the previous strip
+            stitched = False
+            if row_start > 0 and compo.bbox.row_min == row_start:
+                for open_compo in open_compos:
+                    if open_compo.bbox.col_min <= compo.bbox.col_max and compo.bbox.col_min <= open_compo.bbox.col_max:
+                        open_compo.compo_merge(compo)
+                        stitched = True
+                        break
+            if not stitched:
+                compos.append(compo)
+    return compos
+
+
+def strip_block_recognition(org, compos, grad_min, strip_height, block_side_length=0.15):
+    '''
+    Block recognition without a binary map of the whole page: binarize the clip of each candidate compo
+    The height ratio is taken against the strip height, as a block is relative to a screen rather than the page
+    '''
+    width = org.shape[1]
+    for compo in compos:
+        if compo.height / strip_height > block_side_length and compo.width / width > block_side_length:
+            clip = pre.binarization(compo.compo_clipping(org), grad_min=grad_min)
+            if det.is_block(clip):
+                compo.category = 'Block'
+
+
+def nesting_inspection(org, grey, compos, ffl_block, profiler=None, keep_region=True):
     '''
     Inspect all big compos through block division by flood-fill
+    :param grey: grey-scale of org, or None to convert the clip of each compo only
     :param ffl_block: gradient threshold for flood-fill
+    :param profiler: utils.profiling.StageProfiler, None for no profiling
+    :param keep_region: if False, the nesting compos do not keep their pixels
     :return: nesting compos
     '''
     nesting_compos = []
     for i, compo in enumerate(compos):
         if compo.height > 50:
             replace = False
-            clip_grey = compo.compo_clipping(grey)
-            n_compos = det.nested_components_detection(clip_grey, org, grad_thresh=ffl_block, show=False)
+            if grey is not None:
+                clip_grey = compo.compo_clipping(grey)
+            else:
+                clip_grey = cv2.cvtColor(compo.compo_clipping(org), cv2.COLOR_BGR2GRAY)
+            n_compos = det.nested_components_detection(clip_grey, org, grad_thresh=ffl_block, show=False, profiler=profiler,
+                                                       keep_region=keep_region)
             Compo.cvt_compos_relative_pos(n_compos, compo.bbox.col_min, compo.bbox.row_min)
 
             for n_compo in n_compos:
@@ -37,34 +204,155 @@ def nesting_inspection(org, grey, compos, ffl_block):
     return nesting_compos
 
 
+def refine_compos(org, binary, uicompos, uied_params, tile_height=None, profiler=None):
+    '''
+    Filter and merge the detected components and recognize the blocks
+    :param binary: binary map the components are detected from, None in tiled mode
+    :param tile_height: strip height of the tiled mode
+    :param profiler: utils.profiling.StageProfiler, None for no profiling
+    '''
+    # *** Step 3 *** results refinement
+    profile_count(profiler, 'compos_detected', len(uicompos))
+    with profile_stage(profiler, 'filter'):
+        uicompos = det.compo_filter(uicompos, min_area=int(uied_params['min-ele-area']), img_shape=org.shape)
+    profile_count(profiler, 'compos_filtered', len(uicompos))
+    with profile_stage(profiler, 'merge'):
+        uicompos = det.merge_intersected_compos(uicompos, profiler=profiler)
+    profile_count(profiler, 'compos_merged', len(uicompos))
+    with profile_stage(profiler, 'block_recognition'):
+        if binary is not None:
+            det.compo_block_recognition(binary, uicompos)
+        else:
+            strip_block_recognition(org, uicompos, int(uied_params['min-grad']), tile_height)
+    with profile_stage(profiler, 'containment'):
+        if uied_params['merge-contained-ele']:
+            profile_count(profiler, 'contained_relation_checks', len(uicompos) * (len(uicompos) - 1) // 2)
+            uicompos = det.rm_contained_compos_not_in_block(uicompos)
+        Compo.compos_update(uicompos, org.shape)
+        profile_count(profiler, 'contained_relation_checks', len(uicompos) * (len(uicompos) - 1) // 2)
+        Compo.compos_containment(uicompos)
+    profile_count(profiler, 'compos_refined', len(uicompos))
+    return uicompos
+
+
+def plan_memory_budget(shape, memory_budget, tile_height=None, min_tile_height=200):
+    '''
+    Pick the lower-memory strategies the detection of an image needs to stay under the budget, the cheapest first:
+    drop the pixels of the components and skip the board -> detect strip by strip
+    :param shape: shape of the working image
+    :param memory_budget: MB for the allocations of the detection, beyond the process at rest
+    :param tile_height: strip height already asked for, None for the whole image
+    :return: {'estimate_mb', 'keep_region', 'draw_board', 'tile_height'}
+    '''
+    height, width = shape[:2]
+    img_mb = height * width * 3 / 2 ** 20
+
+    def estimate(rows, pixel_bytes):
+        return img_mb + min(rows, height) * width * pixel_bytes / 2 ** 20
+
+    rows = tile_height if tile_height is not None else height
+    plan = {'estimate_mb': estimate(rows, PIXEL_BYTES), 'keep_region': True, 'draw_board': True, 'tile_height': tile_height}
+    if plan['estimate_mb'] <= memory_budget:
+        return plan
+    # the pixels of the components are not used once their boundaries are computed
+    plan.update(estimate_mb=estimate(rows, PIXEL_BYTES_NO_REGION), keep_region=False, draw_board=False)
+    if plan['estimate_mb'] <= memory_budget:
+        return plan
+    # strips small enough for the working arrays to fit next to the image
+    rows = max(min_tile_height, int((memory_budget - img_mb) * 2 ** 20 / (width * PIXEL_BYTES_NO_REGION)))
+    if rows < height:
+        plan.update(estimate_mb=estimate(rows, PIXEL_BYTES_NO_REGION), tile_height=rows)
+    return plan
+
+
 def compo_detection(input_img_path, output_root, uied_params,
-                    resize_by_height=800, classifier=None, show=False, wai_key=0):
+                    resize_by_height=800, classifier=None, show=False, wai_key=0, coarse_height=None,
+                    tile_height=None, tile_overlap=40, tile_workers=1, name=None, raw_shape=None, store=None, render=None,
+                    profiler=None, memory_budget=None, sampler=None):
+    '''
+    :param input_img_path: image path, or raw pixels accepted by pre.read_img (numpy array, buffer, raw frame file)
+    :param name: name of the outputs, taken from the path if not given
+    :param raw_shape: (height, width, channels) of raw pixels in a buffer or raw frame file
+    :param coarse_height: if given, locate candidate regions on a copy resized to this height first
+                          and only analyse those regions at full resolution
+    :param tile_height: if given, keep the native resolution (resize_by_height is ignored) and detect
+                        strips of this height one by one, for very tall full-page screenshots
+    :param tile_overlap: rows shared by consecutive strips
+    :param tile_workers: number of strips processed in parallel
+    :param store: if given, a utils.result_store.ResultStore receiving the result and its board
+                  in place of the files under output_root/ip
+    :param render: utils.render.RenderPolicy deciding if the board is drawn and saved, None for always
+    :param profiler: utils.profiling.StageProfiler recording the time of each stage and the counters of the
+                     detection, None for no profiling
+    :param memory_budget: MB the detection may allocate; if the image is estimated above it, the components drop
+                          their pixels, the board is not drawn and, if still above, the image is detected strip by strip
+    :param sampler: utils.profiling.SampledProfiler capturing the cProfile, stage timings and input of sampled calls
+    '''
 
     start = time.time()
-    name = input_img_path.split('/')[-1][:-4] if '/' in input_img_path else input_img_path.split('\\')[-1][:-4]
-    ip_root = file.build_directory(pjoin(output_root, "ip"))
+    if name is None:
+        if not isinstance(input_img_path, str):
+            name = 'frame'
+        else:
+            name = input_img_path.split('/')[-1][:-4] if '/' in input_img_path else input_img_path.split('\\')[-1][:-4]
+    source = input_img_path if isinstance(input_img_path, str) else name
+    capture = start_capture(sampler, name, 'ip')
+    if capture is not None and profiler is None:
+        profiler = capture.profiler
+    ip_root = file.build_directory(pjoin(output_root, "ip")) if store is None else None
 
     # *** Step 1 *** pre-processing: read img -> get binary map
-    org, grey = pre.read_img(input_img_path, resize_by_height)
-    binary = pre.binarization(org, grad_min=int(uied_params['min-grad']))
+    with profile_stage(profiler, 'read'):
+        if tile_height is not None:
+            # tiled: keep the native resolution
+            org, _ = pre.read_img(input_img_path, shape=raw_shape)
+            grey = None
+        else:
+            org, grey = pre.read_img(input_img_path, resize_by_height, shape=raw_shape)
+    keep_region, draw_board = True, True
+    if memory_budget is not None:
+        plan = plan_memory_budget(org.shape, memory_budget, tile_height)
+        keep_region, draw_board = plan['keep_region'], plan['draw_board']
+        if plan['tile_height'] != tile_height:
+            tile_height, grey = plan['tile_height'], None
+        if not keep_region:
+            print('*** Memory budget %d MB: estimated %.1f MB, components without pixels, no board%s ***' % (
+                memory_budget, plan['estimate_mb'], ', strips of %d rows' % tile_height if tile_height is not None else ''))
 
-    # *** Step 2 *** element detection
-    det.rm_line(binary, show=show, wait_key=wai_key)
-    uicompos = det.component_detection(binary, min_obj_area=int(uied_params['min-ele-area']), rec_detect=True)
+    if tile_height is not None:
+        # *** Step 1-2 *** tiled: detect elements strip by strip
+        binary = None
+        with profile_stage(profiler, 'strip_detection'):
+            uicompos = strip_detection(org, uied_params, tile_height, overlap=tile_overlap, workers=tile_workers, keep_region=keep_region)
+    else:
+        if coarse_height is not None and coarse_height < org.shape[0]:
+            # *** Step 1-2 *** coarse-to-fine: detect elements only inside the regions proposed at low resolution
+            with profile_stage(profiler, 'coarse_to_fine_detection'):
+                binary, uicompos = coarse_to_fine_detection(org, uied_params, coarse_height, keep_region=keep_region)
+        else:
+            with profile_stage(profiler, 'binarize'):
+                binary = pre.binarization(org, grad_min=int(uied_params['min-grad']))
+
+            # *** Step 2 *** element detection
+            with profile_stage(profiler, 'rm_line'):
+                det.rm_line(binary, show=show, wait_key=wai_key)
+            with profile_stage(profiler, 'component_detection'):
+                uicompos = det.component_detection(binary, min_obj_area=int(uied_params['min-ele-area']), profiler=profiler,
+                                                   keep_region=keep_region)
 
     # *** Step 3 *** results refinement
-    uicompos = det.compo_filter(uicompos, min_area=int(uied_params['min-ele-area']), img_shape=binary.shape)
-    uicompos = det.merge_intersected_compos(uicompos)
-    det.compo_block_recognition(binary, uicompos)
-    if uied_params['merge-contained-ele']:
-        uicompos = det.rm_contained_compos_not_in_block(uicompos)
-    Compo.compos_update(uicompos, org.shape)
-    Compo.compos_containment(uicompos)
+    uicompos = refine_compos(org, binary, uicompos, uied_params, tile_height, profiler=profiler)
 
     # *** Step 4 ** nesting inspection: check if big compos have nesting element
-    uicompos += nesting_inspection(org, grey, uicompos, ffl_block=uied_params['ffl-block'])
-    Compo.compos_update(uicompos, org.shape)
-    draw.draw_bounding_box(org, uicompos, show=show, name='merged compo', write_path=pjoin(ip_root, name + '.jpg'), wait_key=wai_key)
+    with profile_stage(profiler, 'nesting'):
+        uicompos += nesting_inspection(org, grey, uicompos, ffl_block=uied_params['ffl-block'], profiler=profiler,
+                                       keep_region=keep_region)
+        Compo.compos_update(uicompos, org.shape)
+    profile_count(profiler, 'compos_nested', len(uicompos))
+    rendered = draw_board and should_render(render, name, error=len(uicompos) == 0)
+    with profile_stage(profiler, 'draw'):
+        board = draw.draw_bounding_box(org, uicompos, show=show, name='merged compo', wait_key=wai_key, is_return=rendered and store is not None,
+                                       write_path=pjoin(ip_root, name + '.jpg') if rendered and store is None else None)
 
     # *** Step 5 *** image inspection: recognize image -> remove noise in image -> binarize with larger threshold and reverse -> rectangular compo detection
     # if classifier is not None:
@@ -81,11 +369,68 @@ def compo_detection(input_img_path, output_root, uied_params,
 
     # *** Step 6 *** element classification: all category classification
     if classifier is not None:
-         classifier['Elements'].predict([compo.compo_clipping(org) for compo in uicompos], uicompos)
-         draw.draw_bounding_box_class(org, uicompos, show=show, name='cls', write_path=pjoin(ip_root, 'result.jpg'))
-         draw.draw_bounding_box_class(org, uicompos, write_path=pjoin(output_root, 'result.jpg'))
+        with profile_stage(profiler, 'classification'):
+            classifier['Elements'].predict([compo.compo_clipping(org) for compo in uicompos], uicompos)
+            # the class board follows the render policy as the detection board
+            if show or (rendered and store is None):
+                draw.draw_bounding_box_class(org, uicompos, show=show, name='cls',
+                                             write_path=pjoin(ip_root, name + '_cls.jpg') if rendered and store is None else None)
 
     # *** Step 7 *** save detection result
-    Compo.compos_update(uicompos, org.shape)
-    file.save_corners_json(pjoin(ip_root, name + '.json'), uicompos)
-    print("[Compo Detection Completed in %.3f s] Input: %s Output: %s" % (time.time() - start, input_img_path, pjoin(ip_root, name + '.json')))
+    with profile_stage(profiler, 'save'):
+        Compo.compos_update(uicompos, org.shape)
+        if store is not None:
+            store.put(name, 'ip', file.wrap_corners(uicompos, org.shape), board if rendered else None)
+            output = '%s [%s]' % (store.db_path, name)
+        else:
+            file.save_corners_json(pjoin(ip_root, name + '.json'), uicompos)
+            output = pjoin(ip_root, name + '.json')
+    # raw buffers are captured as the image read from them
+    finish_capture(capture, [input_img_path if isinstance(input_img_path, (str, np.ndarray)) else org], profiler)
+    print("[Compo Detection Completed in %.3f s] Input: %s Output: %s" % (time.time() - start, source, output))
+    return uicompos
+
+
+def detect_many(images, output_root, uied_params, workers=None, **kwargs):
+    '''
+    Detect the components of several screenshots on a thread pool within this process
+    OpenCV and NumPy release the GIL in the heavy steps, so threads scale without the pickling
+    and memory duplication of a process pool. Every call works on its own arrays and parameters.
+    Keep show=False and a classifier that is safe to share across threads.
+    :param images: image paths, raw images, or (name, image) pairs
+    :param workers: number of threads, default as ThreadPoolExecutor
+    :return: list of the components of each image, in the order of images
+    '''
+    def detect(image):
+        name = None
+        if isinstance(image, tuple):
+            name, image = image
+        return compo_detection(image, output_root, dict(uied_params), name=name, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(detect, images))
+
+
+def detect_stream(frames, output_root, uied_params, workers=None, max_pending=None, **kwargs):
+    '''
+    Detect the components of a stream of screenshots on a thread pool, reading the stream only as fast as it is detected
+    :param frames: iterable of utils.image_stream.Frame, the decoded image is used if there is one, else its path
+    :param workers: number of threads, default as ThreadPoolExecutor
+    :param max_pending: frames submitted and not yet yielded, default twice the threads; bounds the images held in memory
+    :return: iterator of (name, components), in the order of frames
+    '''
+    def detect(frame):
+        image = frame.image if frame.image is not None else frame.path
+        return frame.name, compo_detection(image, output_root, dict(uied_params), name=frame.name, **kwargs)
+
+    if max_pending is None:
+        # the default number of threads of ThreadPoolExecutor
+        max_pending = 2 * (workers if workers is not None else min(32, (os.cpu_count() or 1) + 4))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for frame in frames:
+            pending.append(executor.submit(detect, frame))
+            if len(pending) >= max_pending:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
@@ -1,7 +1,9 @@
 from detect_compo.lib_ip.Bbox import Bbox
 import detect_compo.lib_ip.ip_draw as draw
 
+import copy
 import cv2
+import numpy as np
 
 
 def cvt_compos_relative_pos(compos, col_min_base, row_min_base):
@@ -19,6 +21,18 @@ def compos_containment(compos):
                 compos[i].contain.append(j)
 
 
+def compos_copy(compos):
+    '''
+    Copy the compos for refinement, sharing their regions and boundaries as the refinement only replaces attributes
+    '''
+    copies = []
+    for compo in compos:
+        c = copy.copy(compo)
+        c.contain = list(compo.contain)
+        copies.append(c)
+    return copies
+
+
 def compos_update(compos, org_shape):
     for i, compo in enumerate(compos):
         # start from 1, id 0 is background
@@ -67,26 +81,23 @@ class Component:
         -> up, bottom: (column_index, min/max row border)
         -> left, right: (row_index, min/max column border) detect range of each row
         '''
-        border_up, border_bottom, border_left, border_right = {}, {}, {}, {}
-        for point in self.region:
-            # point: (row_index, column_index)
-            # up, bottom: (column_index, min/max row border) detect range of each column
-            if point[1] not in border_up or border_up[point[1]] > point[0]:
-                border_up[point[1]] = point[0]
-            if point[1] not in border_bottom or border_bottom[point[1]] < point[0]:
-                border_bottom[point[1]] = point[0]
-            # left, right: (row_index, min/max column border) detect range of each row
-            if point[0] not in border_left or border_left[point[0]] > point[1]:
-                border_left[point[0]] = point[1]
-            if point[0] not in border_right or border_right[point[0]] < point[1]:
-                border_right[point[0]] = point[1]
-
-        boundary = [border_up, border_bottom, border_left, border_right]
-        # descending sort
-        for i in range(len(boundary)):
-            boundary[i] = [[k, boundary[i][k]] for k in boundary[i].keys()]
-            boundary[i] = sorted(boundary[i], key=lambda x: x[0])
-        return boundary
+        def min_max_borders(keys, values):
+            # sort by key then value, the first and last entry of each key hold its min and max value
+            order = np.lexsort((values, keys))
+            keys, values = keys[order], values[order]
+            firsts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+            lasts = np.r_[firsts[1:], len(keys)] - 1
+            return np.stack((keys[firsts], values[firsts]), axis=1).tolist(), \
+                   np.stack((keys[lasts], values[lasts]), axis=1).tolist()
+
+        # point: (row_index, column_index)
+        points = np.asarray(self.region).reshape(-1, 2)
+        # up, bottom: (column_index, min/max row border) detect range of each column
+        border_up, border_bottom = min_max_borders(points[:, 1], points[:, 0])
+        # left, right: (row_index, min/max column border) detect range of each row
+        border_left, border_right = min_max_borders(points[:, 0], points[:, 1])
+        # ascending sort by index
+        return [border_up, border_bottom, border_left, border_right]
 
     def compo_get_bbox(self):
         """
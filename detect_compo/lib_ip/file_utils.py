@@ -1,10 +1,11 @@
 import os
 import pandas as pd
-import json
 from os.path import join as pjoin
 import time
 import cv2
 
+from utils.element_store import save_result
+
 
 def save_corners(file_path, corners, compo_name, clear=True):
     try:
@@ -25,19 +26,26 @@ def save_corners(file_path, corners, compo_name, clear=True):
     df.to_csv(file_path)
 
 
-def save_corners_json(file_path, compos):
-    img_shape = compos[0].image_shape
+def wrap_corners(compos, img_shape=None):
+    if img_shape is None:
+        img_shape = compos[0].image_shape
     output = {'img_shape': img_shape, 'compos': []}
-    f_out = open(file_path, 'w')
-
     for compo in compos:
         c = {'id': compo.id, 'class': compo.category}
         (c['column_min'], c['row_min'], c['column_max'], c['row_max']) = compo.put_bbox()
         c['width'] = compo.width
         c['height'] = compo.height
         output['compos'].append(c)
+    return output
 
-    json.dump(output, f_out, indent=4)
+
+def save_corners_json(file_path, compos):
+    '''
+    :param file_path: .npz for the packed format, JSON otherwise
+    '''
+    output = wrap_corners(compos)
+    save_result(file_path, output)
+    return output
 
 
 def save_clipping(org, output_root, corners, compo_classes, compo_index):
@@ -67,6 +75,6 @@ def save_clipping(org, output_root, corners, compo_classes, compo_index):
 
 
 def build_directory(directory):
-    if not os.path.exists(directory):
-        os.mkdir(directory)
+    # tolerate concurrent creation by detection threads
+    os.makedirs(directory, exist_ok=True)
     return directory
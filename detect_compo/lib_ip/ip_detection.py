@@ -6,6 +6,7 @@ import detect_compo.lib_ip.ip_preprocessing as pre
 from detect_compo.lib_ip.Component import Component
 import detect_compo.lib_ip.Component as Compo
 from config.CONFIG_UIED import Config
+from utils.profiling import profile_count
 C = Config()
 
 
@@ -50,7 +51,11 @@ def merge_intersected_corner(compos, org, is_merge_contained_ele, max_gap=(0, 0)
         return merge_intersected_corner(new_compos, org, is_merge_contained_ele, max_gap, max_ele_height)
 
 
-def merge_intersected_compos(compos):
+def merge_intersected_compos(compos, profiler=None):
+    '''
+    :param profiler: utils.profiling.StageProfiler counting the relation checks, None for no profiling
+    '''
+    checks = 0
     changed = True
     while changed:
         changed = False
@@ -58,6 +63,7 @@ def merge_intersected_compos(compos):
         for compo_a in compos:
             merged = False
             for compo_b in temp_set:
+                checks += 1
                 if compo_a.compo_relation(compo_b) == 2:
                     compo_b.compo_merge(compo_a)
                     merged = True
@@ -66,6 +72,7 @@ def merge_intersected_compos(compos):
             if not merged:
                 temp_set.append(compo_a)
         compos = temp_set.copy()
+    profile_count(profiler, 'merge_relation_checks', checks)
     return compos
 
 
@@ -133,7 +140,7 @@ def merge_text(compos, org_shape, max_word_gad=4, max_word_height=20):
     if not changed:
         return compos
     else:
-        return merge_text(new_compos, org_shape)
+        return merge_text(new_compos, org_shape, max_word_gad, max_word_height)
 
 
 def rm_top_or_bottom_corners(components, org_shape, top_bottom_height=C.THRESHOLD_TOP_BOTTOM_BAR):
@@ -228,30 +235,24 @@ def rm_line(binary,
             min_line_length_ratio=C.THRESHOLD_LINE_MIN_LENGTH,
             show=False, wait_key=0):
     def is_valid_line(line):
-        line_length = 0
-        line_gap = 0
-        for j in line:
-            if j > 0:
-                if line_gap > 5:
-                    return False
-                line_length += 1
-                line_gap = 0
-            elif line_length > 0:
-                line_gap += 1
-        if line_length / width > 0.95:
-            return True
-        return False
+        # long enough and without any gap over 5 pixels between its pixels
+        line_pixels = np.flatnonzero(line)
+        if len(line_pixels) / width <= 0.95:
+            return False
+        return not np.any(np.diff(line_pixels) > 6)
 
     height, width = binary.shape[:2]
-    board = np.zeros(binary.shape[:2], dtype=np.uint8)
+    # only rows filled over 95% can be lines, count them at once
+    long_rows = np.count_nonzero(binary, axis=1) / width > 0.95
+    valid_rows = [bool(long_rows[i]) and is_valid_line(binary[i]) for i in range(height)]
 
     start_row, end_row = -1, -1
     check_line = False
     check_gap = False
-    for i, row in enumerate(binary):
+    for i in range(height):
         # line_ratio = (sum(row) / 255) / width
         # if line_ratio > 0.9:
-        if is_valid_line(row):
+        if valid_rows[i]:
             # new start: if it is checking a new line, mark this row as start
             if not check_line:
                 start_row = i
@@ -396,6 +397,26 @@ def compo_block_recognition(binary, compos, block_side_length=0.15):
                 compo.category = 'Block'
 
 
+def flood_fill_region(img, mask, seed, diff):
+    '''
+    Flood fill from the seed and mark the filled area in the mask
+    Only the bounding rectangle of the new area is scanned, rather than the whole mask copied and compared per seed
+    :param mask: flood-fill mask of img, 2 pixels larger, non-zero where already filled
+    :param seed: (column, row)
+    :param diff: maximal lower/upper brightness difference between neighbours
+    :return: int32 (row, column) pixels of the filled area in row-major order, None if nothing is filled
+    '''
+    # fill the new area with 2 to tell it apart, then settle it to 1 as the earlier areas
+    area, _, _, (col, row, width, height) = cv2.floodFill(img, mask, seed, None, diff, diff, cv2.FLOODFILL_MASK_ONLY | (2 << 8))
+    if area == 0:
+        return None
+    new_fill = mask[row + 1: row + height + 1, col + 1: col + width + 1]
+    filled = new_fill == 2
+    new_fill[filled] = 1
+    # int32 (column, row) points of findNonZero, flipped, take half the memory of int64 argwhere
+    return cv2.findNonZero(filled.view(np.uint8)).reshape(-1, 2)[:, ::-1] + np.array((row, col), dtype=np.int32)
+
+
 # take the binary image as input
 # calculate the connected regions -> get the bounding boundaries of them -> check if those regions are rectangles
 # return all boundaries and boundaries of rectangles
@@ -404,7 +425,7 @@ def component_detection(binary, min_obj_area,
                         min_rec_evenness=C.THRESHOLD_REC_MIN_EVENNESS,
                         max_dent_ratio=C.THRESHOLD_REC_MAX_DENT_RATIO,
                         step_h = 5, step_v = 2,
-                        rec_detect=False, show=False, test=False):
+                        rec_detect=False, show=False, test=False, profiler=None, keep_region=True):
     """
     :param binary: Binary image from pre-processing
     :param min_obj_area: If not pass then ignore the small object
@@ -412,6 +433,8 @@ def component_detection(binary, min_obj_area,
     :param line_thickness: If not pass then ignore the slim object
     :param min_rec_evenness: If not pass then this object cannot be rectangular
     :param max_dent_ratio: If not pass then this object cannot be rectangular
+    :param profiler: utils.profiling.StageProfiler counting the seeds and flood fills, None for no profiling
+    :param keep_region: if False, drop the pixels of each component once its boundary is computed
     :return: boundary: [top, bottom, left, right]
                         -> up, bottom: list of (column_index, min/max row border)
                         -> left, right: list of (row_index, min/max column border) detect range of each row
@@ -420,22 +443,24 @@ def component_detection(binary, min_obj_area,
     compos_all = []
     compos_rec = []
     compos_nonrec = []
-    row, column = binary.shape[0], binary.shape[1]
+    row = binary.shape[0]
+    seeds, fills = 0, 0
     for i in range(0, row, step_h):
-        for j in range(i % 2, column, step_v):
-            if binary[i, j] == 255 and mask[i, j] == 0:
+        # seeds of this row: foreground pixels on the sampled columns
+        row_seeds = np.flatnonzero(binary[i, i % 2::step_v] == 255) * step_v + i % 2
+        seeds += len(row_seeds)
+        for j in row_seeds:
+            if mask[i, j] == 0:
                 # get connected area
                 # region = util.boundary_bfs_connected_area(binary, i, j, mask)
-
-                mask_copy = mask.copy()
-                ff = cv2.floodFill(binary, mask, (j, i), None, 0, 0, cv2.FLOODFILL_MASK_ONLY)
-                if ff[0] < min_obj_area: continue
-                mask_copy = mask - mask_copy
-                region = np.reshape(cv2.findNonZero(mask_copy[1:-1, 1:-1]), (-1, 2))
-                region = [(p[1], p[0]) for p in region]
+                fills += 1
+                region = flood_fill_region(binary, mask, (int(j), i), 0)
+                if region is None or len(region) < min_obj_area: continue
 
                 # filter out some compos
                 component = Component(region, binary.shape)
+                if not keep_region:
+                    component.region = None
                 # calculate the boundary of the connected area
                 # ignore small area
                 if component.width <= 3 or component.height <= 3:
@@ -464,6 +489,8 @@ def component_detection(binary, min_obj_area,
                     draw.draw_boundary(compos_all, binary.shape, show=True)
 
     # draw.draw_boundary(compos_all, binary.shape, show=True)
+    profile_count(profiler, 'seeds', seeds)
+    profile_count(profiler, 'flood_fills', fills)
     if rec_detect:
         return compos_rec, compos_nonrec
     else:
@@ -475,34 +502,37 @@ def nested_components_detection(grey, org, grad_thresh,
                    step_h=10, step_v=10,
                    line_thickness=C.THRESHOLD_LINE_THICKNESS,
                    min_rec_evenness=C.THRESHOLD_REC_MIN_EVENNESS,
-                   max_dent_ratio=C.THRESHOLD_REC_MAX_DENT_RATIO):
+                   max_dent_ratio=C.THRESHOLD_REC_MAX_DENT_RATIO, profiler=None, keep_region=True):
     '''
     :param grey: grey-scale of original image
+    :param profiler: utils.profiling.StageProfiler counting the seeds and flood fills, None for no profiling
+    :param keep_region: if False, drop the pixels of each component once its boundary is computed
     :return: corners: list of [(top_left, bottom_right)]
                         -> top_left: (column_min, row_min)
                         -> bottom_right: (column_max, row_max)
     '''
     compos = []
     mask = np.zeros((grey.shape[0]+2, grey.shape[1]+2), dtype=np.uint8)
-    broad = np.zeros((grey.shape[0], grey.shape[1], 3), dtype=np.uint8)
-    broad_all = broad.copy()
+    if show or write_path is not None:
+        broad = np.zeros((grey.shape[0], grey.shape[1], 3), dtype=np.uint8)
+        broad_all = broad.copy()
 
     row, column = grey.shape[0], grey.shape[1]
+    fills = 0
     for x in range(0, row, step_h):
         for y in range(0, column, step_v):
             if mask[x, y] == 0:
                 # region = flood_fill_bfs(grey, x, y, mask)
 
                 # flood fill algorithm to get background (layout block)
-                mask_copy = mask.copy()
-                ff = cv2.floodFill(grey, mask, (y, x), None, grad_thresh, grad_thresh, cv2.FLOODFILL_MASK_ONLY)
+                fills += 1
+                region = flood_fill_region(grey, mask, (y, x), grad_thresh)
                 # ignore small regions
-                if ff[0] < 500: continue
-                mask_copy = mask - mask_copy
-                region = np.reshape(cv2.findNonZero(mask_copy[1:-1, 1:-1]), (-1, 2))
-                region = [(p[1], p[0]) for p in region]
+                if region is None or len(region) < 500: continue
 
                 compo = Component(region, grey.shape)
+                if not keep_region:
+                    compo.region = None
                 # draw.draw_region(region, broad_all)
                 # if block.height < 40 and block.width < 40:
                 #     continue
@@ -532,4 +562,6 @@ def nested_components_detection(grey, org, grad_thresh,
         cv2.waitKey()
     if write_path is not None:
         cv2.imwrite(write_path, broad)
+    profile_count(profiler, 'nested_seeds', len(range(0, row, step_h)) * len(range(0, column, step_v)))
+    profile_count(profiler, 'nested_flood_fills', fills)
     return compos
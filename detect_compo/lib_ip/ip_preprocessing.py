@@ -4,8 +4,32 @@ from config.CONFIG_UIED import Config
 C = Config()
 
 
-def read_img(path, resize_height=None, kernel_size=None):
+def load_image(src, shape=None, offset=0):
+    '''
+    Load an image, skipping the encode/decode round trip whenever the input already holds raw pixels
+    :param src: - image path, decoded by cv2.imread, or a raw frame file memory-mapped if shape is given
+                - numpy array of BGR/BGRA pixels
+                - bytes/bytearray/memoryview of raw BGR/BGRA pixels if shape is given, otherwise of an encoded image (e.g. Appium png)
+    :param shape: (height, width, channels) of the raw pixels
+    :param offset: bytes to skip before the pixels (e.g. header of the raw frame file)
+    :return: BGR/BGRA image, a read-only view of src where the layout allows
+    '''
+    if isinstance(src, np.ndarray):
+        return src
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        if shape is None:
+            return cv2.imdecode(np.frombuffer(src, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return np.frombuffer(src, dtype=np.uint8, count=int(np.prod(shape)), offset=offset).reshape(shape)
+    if shape is not None:
+        return np.memmap(src, dtype=np.uint8, mode='r', offset=offset, shape=tuple(shape))
+    return cv2.imread(src)
 
+
+def read_img(path, resize_height=None, kernel_size=None, shape=None):
+    '''
+    :param path: image path, raw frame file, numpy array or buffer, see load_image
+    :param shape: (height, width, channels) of raw pixels in path
+    '''
     def resize_by_height(org):
         w_h_ratio = org.shape[1] / org.shape[0]
         resize_w = resize_height * w_h_ratio
@@ -13,14 +37,19 @@ def read_img(path, resize_height=None, kernel_size=None):
         return re
 
     try:
-        img = cv2.imread(path)
-        if kernel_size is not None:
-            img = cv2.medianBlur(img, kernel_size)
+        img = load_image(path, shape)
         if img is None:
             print("*** Image does not exist ***")
             return None, None
+        if kernel_size is not None:
+            img = cv2.medianBlur(img, kernel_size)
         if resize_height is not None:
             img = resize_by_height(img)
+        # the pipeline works on BGR, only convert (and copy) the other layouts
+        if len(img.shape) == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        elif img.shape[2] == 4:
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         return img, gray
 
@@ -33,13 +62,11 @@ def read_img(path, resize_height=None, kernel_size=None):
 def gray_to_gradient(img):
     if len(img.shape) == 3:
         img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    img_f = np.copy(img)
-    img_f = img_f.astype("float")
-
-    kernel_h = np.array([[0,0,0], [0,-1.,1.], [0,0,0]])
-    kernel_v = np.array([[0,0,0], [0,-1.,0], [0,1.,0]])
-    dst1 = abs(cv2.filter2D(img_f, -1, kernel_h))
-    dst2 = abs(cv2.filter2D(img_f, -1, kernel_v))
+    # int16 holds the differences of uint8 pixels exactly, at 2 bytes per pixel rather than 8 of float64
+    kernel_h = np.array([[0,0,0], [0,-1.,1.], [0,0,0]], dtype=np.float32)
+    kernel_v = np.array([[0,0,0], [0,-1.,0], [0,1.,0]], dtype=np.float32)
+    dst1 = np.abs(cv2.filter2D(img, cv2.CV_16S, kernel_h))
+    dst2 = np.abs(cv2.filter2D(img, cv2.CV_16S, kernel_v))
     gradient = (dst1 + dst2).astype('uint8')
     return gradient
 
@@ -55,11 +82,15 @@ def reverse_binary(bin, show=False):
     return bin
 
 
+def binarize_gradient(grad, grad_min):
+    rec, binary = cv2.threshold(grad, grad_min, 255, cv2.THRESH_BINARY)    # enhance the RoI
+    return cv2.morphologyEx(binary, cv2.MORPH_CLOSE, (3, 3))  # remove noises
+
+
 def binarization(org, grad_min, show=False, write_path=None, wait_key=0):
     grey = cv2.cvtColor(org, cv2.COLOR_BGR2GRAY)
     grad = gray_to_gradient(grey)        # get RoI with high gradient
-    rec, binary = cv2.threshold(grad, grad_min, 255, cv2.THRESH_BINARY)    # enhance the RoI
-    morph = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, (3, 3))  # remove noises
+    morph = binarize_gradient(grad, grad_min)
     if write_path is not None:
         cv2.imwrite(write_path, morph)
     if show:
@@ -23,7 +23,10 @@ class Element:
     def put_bbox(self):
         return self.col_min, self.row_min, self.col_max, self.row_max
 
-    def wrap_info(self):
+    def wrap_info(self, nested=False):
+        '''
+        :param nested: if True, children are wrapped as nested element dicts rather than listed by id
+        '''
         info = {'id':self.id, 'class': self.category, 'height': self.height, 'width': self.width,
                 'position': {'column_min': self.col_min, 'row_min': self.row_min, 'column_max': self.col_max,
                              'row_max': self.row_max}}
@@ -32,7 +35,7 @@ class Element:
         if len(self.children) > 0:
             info['children'] = []
             for child in self.children:
-                info['children'].append(child.id)
+                info['children'].append(child.wrap_info(nested=True) if nested else child.id)
         if self.parent_id is not None:
             info['parent'] = self.parent_id
         return info
@@ -94,6 +97,13 @@ class Element:
             return 1
         return 2
 
+    def is_enclosed_by(self, element_b, bias=(0, 0)):
+        '''
+        @bias: (horizontal bias, vertical bias) that self may exceed element_b by on each side
+        '''
+        return element_b.col_min - bias[0] <= self.col_min and self.col_max <= element_b.col_max + bias[0] and \
+               element_b.row_min - bias[1] <= self.row_min and self.row_max <= element_b.row_max + bias[1]
+
     def visualize_element(self, img, color=(0, 255, 0), line=1, show=False):
         loc = self.put_bbox()
         cv2.rectangle(img, loc[:2], loc[2:], color, line)
@@ -0,0 +1,36 @@
+class GridIndex:
+    '''
+    Uniform grid over bboxes: each key is listed in every cell its bbox covers,
+    so a query only visits the keys listed in the cells covered by the queried area
+    '''
+    def __init__(self, cell_size=50):
+        self.cell_size = cell_size
+        self.cells = {}     # (cell column, cell row) -> set of keys
+
+    def cells_covered(self, bbox, bias=(0, 0)):
+        col_min, row_min, col_max, row_max = bbox
+        size = self.cell_size
+        for cell_col in range(int((col_min - bias[0]) // size), int((col_max + bias[0]) // size) + 1):
+            for cell_row in range(int((row_min - bias[1]) // size), int((row_max + bias[1]) // size) + 1):
+                yield cell_col, cell_row
+
+    def insert(self, key, bbox):
+        '''
+        Insert or grow the area of a key, the cells already listing it are kept
+        :param bbox: (col_min, row_min, col_max, row_max)
+        '''
+        for cell in self.cells_covered(bbox):
+            if cell not in self.cells:
+                self.cells[cell] = set()
+            self.cells[cell].add(key)
+
+    def query(self, bbox, bias=(0, 0)):
+        '''
+        :param bias: (horizontal bias, vertical bias) to expand the queried bbox on each side
+        :return: sorted keys whose bbox may intersect the expanded bbox, a superset of the intersected ones
+        '''
+        keys = set()
+        for cell in self.cells_covered(bbox, bias):
+            if cell in self.cells:
+                keys.update(self.cells[cell])
+        return sorted(keys)
@@ -1,12 +1,16 @@
-import json
 import cv2
 import numpy as np
 from os.path import join as pjoin
 import os
 import time
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 from detect_merge.Element import Element
+from detect_merge.GridIndex import GridIndex
+from utils.element_store import save_result, load_result
+from utils.render import should_render
+from utils.profiling import profile_stage, start_capture, finish_capture
 
 
 def show_elements(org_img, eles, show=False, win_name='element', wait_key=0, shown_resize=None, line=2):
@@ -26,13 +30,28 @@ def show_elements(org_img, eles, show=False, win_name='element', wait_key=0, sho
     return img_resize
 
 
-def save_elements(output_file, elements, img_shape):
+def wrap_elements(elements, img_shape, nested=False):
+    '''
+    :param nested: if False, keep all elements with their children and parent listed by id (adjacency);
+                   if True, keep only the root elements with their descendants nested under 'children'
+    '''
     components = {'compos': [], 'img_shape': img_shape}
     for i, ele in enumerate(elements):
-        c = ele.wrap_info()
+        if nested and ele.parent_id is not None:
+            continue
+        c = ele.wrap_info(nested=nested)
         # c['id'] = i
         components['compos'].append(c)
-    json.dump(components, open(output_file, 'w'), indent=4)
+    return components
+
+
+def save_elements(output_file, elements, img_shape, nested=False):
+    '''
+    :param output_file: .npz for the packed format, JSON otherwise
+    :param nested: see wrap_elements
+    '''
+    components = wrap_elements(elements, img_shape, nested=nested)
+    save_result(output_file, components)
     return components
 
 
@@ -63,16 +82,21 @@ def merge_text_line_to_paragraph(elements, max_line_gap=5):
     while changed:
         changed = False
         temp_set = []
+        # index of temp_set positions, only nearby lines are checked
+        temp_index = GridIndex()
         for text_a in texts:
             merged = False
-            for text_b in temp_set:
+            for k in temp_index.query(text_a.put_bbox(), bias=(0, max_line_gap)):
+                text_b = temp_set[k]
                 inter_area, _, _, _ = text_a.calc_intersection_area(text_b, bias=(0, max_line_gap))
                 if inter_area > 0:
                     text_b.element_merge(text_a)
+                    temp_index.insert(k, text_b.put_bbox())
                     merged = True
                     changed = True
                     break
             if not merged:
+                temp_index.insert(len(temp_set), text_a.put_bbox())
                 temp_set.append(text_a)
         texts = temp_set.copy()
     return non_texts + texts
@@ -86,10 +110,15 @@ def refine_elements(compos, texts, intersection_bias=(2, 2), containment_ratio=0
     '''
     elements = []
     contained_texts = []
+    text_index = GridIndex()
+    for i, text in enumerate(texts):
+        text_index.insert(i, text.put_bbox())
     for compo in compos:
         is_valid = True
         text_area = 0
-        for text in texts:
+        # texts far from the compo have no intersection, check the nearby ones in their original order
+        for k in text_index.query(compo.put_bbox(), bias=intersection_bias):
+            text = texts[k]
             inter, iou, ioa, iob = compo.calc_intersection_area(text, bias=intersection_bias)
             if inter > 0:
                 # the non-text is contained in the text compo
@@ -113,16 +142,32 @@ def refine_elements(compos, texts, intersection_bias=(2, 2), containment_ratio=0
     return elements
 
 
-def check_containment(elements):
-    for i in range(len(elements) - 1):
-        for j in range(i + 1, len(elements)):
-            relation = elements[i].element_relation(elements[j], bias=(2, 2))
-            if relation == -1:
-                elements[j].children.append(elements[i])
-                elements[i].parent_id = elements[j].id
-            if relation == 1:
-                elements[i].children.append(elements[j])
-                elements[j].parent_id = elements[i].id
+def check_containment(elements, bias=(2, 2)):
+    '''
+    Build the containment tree: the parent of an element is the smallest element enclosing it
+    - elements are visited by descending area, so all the possible parents of one are indexed before it
+    - the last enclosing candidate in visiting order is the smallest one
+    - of two identical elements, the later one is the parent
+    '''
+    for element in elements:
+        element.parent_id = None
+        element.children = []
+    order = sorted(range(len(elements)), key=lambda k: (-elements[k].area, -k))
+    index = GridIndex()     # keys are the visiting ranks
+    for rank, k in enumerate(order):
+        element = elements[k]
+        parent = None
+        # an element may exceed its parent by bias, so the parent can lie in the cells next to it
+        for r in index.query(element.put_bbox(), bias=bias):
+            candidate = elements[order[r]]
+            if element.is_enclosed_by(candidate, bias):
+                parent = candidate
+        if parent is not None:
+            element.parent_id = parent.id
+            parent.children.append(element)
+        index.insert(rank, element.put_bbox())
+    for element in elements:
+        element.children.sort(key=lambda child: child.id)
 
 
 def remove_top_bar(elements, img_height):
@@ -145,29 +190,39 @@ def remove_bottom_bar(elements, img_height):
     return new_elements
 
 
-def compos_clip_and_fill(clip_root, org, compos):
-    def most_pix_around(pad=6, offset=2):
-        '''
-        determine the filled background color according to the most surrounding pixel
-        '''
+def most_pix_around(org, bboxes, pad=6, offset=2):
+    '''
+    determine the filled background color of each bbox according to the most surrounding pixel of each channel
+    the histograms of all bboxes and channels are counted together by a single bincount
+    :param bboxes: list of (col_min, row_min, col_max, row_max)
+    :return: array (len(bboxes), 3) of colors
+    '''
+    channel_offset = np.arange(3) * 256
+    codes = []
+    for k, (col_min, row_min, col_max, row_max) in enumerate(bboxes):
         up = row_min - pad if row_min - pad >= 0 else 0
         left = col_min - pad if col_min - pad >= 0 else 0
         bottom = row_max + pad if row_max + pad < org.shape[0] - 1 else org.shape[0] - 1
         right = col_max + pad if col_max + pad < org.shape[1] - 1 else org.shape[1] - 1
-        most = []
-        for i in range(3):
-            val = np.concatenate((org[up:row_min - offset, left:right, i].flatten(),
-                            org[row_max + offset:bottom, left:right, i].flatten(),
-                            org[up:bottom, left:col_min - offset, i].flatten(),
-                            org[up:bottom, col_max + offset:right, i].flatten()))
-            most.append(int(np.argmax(np.bincount(val))))
-        return most
+        for strip in (org[up:row_min - offset, left:right], org[row_max + offset:bottom, left:right],
+                      org[up:bottom, left:col_min - offset], org[up:bottom, col_max + offset:right]):
+            codes.append((strip.reshape(-1, 3) + channel_offset + k * 768).ravel())
+    if len(codes) == 0:
+        return np.zeros((0, 3), dtype=int)
+    hist = np.bincount(np.concatenate(codes), minlength=len(bboxes) * 768)
+    return hist.reshape(len(bboxes), 3, 256).argmax(axis=2)
+
 
+def compos_clip_and_fill(clip_root, org, compos, workers=4):
+    '''
+    :param workers: number of threads writing the clips
+    '''
     if os.path.exists(clip_root):
         shutil.rmtree(clip_root)
     os.mkdir(clip_root)
 
-    bkg = org.copy()
+    bboxes = []
+    fill_compos = []
     cls_dirs = []
     for compo in compos:
         cls = compo['class']
@@ -175,23 +230,61 @@ def compos_clip_and_fill(clip_root, org, compos):
             compo['path'] = pjoin(clip_root, 'bkg.png')
             continue
         c_root = pjoin(clip_root, cls)
-        c_path = pjoin(c_root, str(compo['id']) + '.jpg')
-        compo['path'] = c_path
+        compo['path'] = pjoin(c_root, str(compo['id']) + '.jpg')
         if cls not in cls_dirs:
             os.mkdir(c_root)
             cls_dirs.append(cls)
-
         position = compo['position']
-        col_min, row_min, col_max, row_max = position['column_min'], position['row_min'], position['column_max'], position['row_max']
-        cv2.imwrite(c_path, org[row_min:row_max, col_min:col_max])
-        # Fill up the background area
-        cv2.rectangle(bkg, (col_min, row_min), (col_max, row_max), most_pix_around(), -1)
-    cv2.imwrite(pjoin(clip_root, 'bkg.png'), bkg)
+        bboxes.append((position['column_min'], position['row_min'], position['column_max'], position['row_max']))
+        fill_compos.append(compo)
 
-
-def merge(img_path, compo_path, text_path, merge_root=None, is_paragraph=False, is_remove_bar=True, show=False, wait_key=0):
-    compo_json = json.load(open(compo_path, 'r'))
-    text_json = json.load(open(text_path, 'r'))
+    bkg = org.copy()
+    colors = most_pix_around(org, bboxes)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        writes = []
+        for compo, (col_min, row_min, col_max, row_max), color in zip(fill_compos, bboxes, colors):
+            writes.append(executor.submit(cv2.imwrite, compo['path'], org[row_min:row_max, col_min:col_max]))
+            # Fill up the background area
+            cv2.rectangle(bkg, (col_min, row_min), (col_max, row_max), [int(c) for c in color], -1)
+        writes.append(executor.submit(cv2.imwrite, pjoin(clip_root, 'bkg.png'), bkg))
+        for write in writes:
+            write.result()
+
+
+def load_stage_result(store, name, stage, result_root=None):
+    '''
+    The result of a stage from the store, else from its file under result_root/stage, as saved before the store was used
+    :param result_root: output root of the run, the directory of the store if None
+    '''
+    result = store.get(name, stage)
+    if result is not None:
+        return result
+    if result_root is None:
+        result_root = os.path.dirname(store.db_path)
+    for ext in ('.json', '.npz'):
+        if os.path.exists(pjoin(result_root, stage, name + ext)):
+            return load_result(pjoin(result_root, stage, name + ext))
+    raise ValueError('No %s result of %s in the store %s nor under %s' % (stage, name, store.db_path, pjoin(result_root, stage)))
+
+
+def merge(img_path, compo_path, text_path, merge_root=None, is_paragraph=False, is_remove_bar=True, show=False, wait_key=0,
+          nested=False, store=None, render=None, profiler=None, sampler=None, result_root=None):
+    '''
+    :param store: if given, a utils.result_store.ResultStore receiving the result and its board in place of
+                  the files under merge_root; the compo and text results are read from it when their path is None
+    :param result_root: output root holding ip/ and ocr/ result files, read for a stage missing in the store,
+                        the directory of the store if None
+    :param render: utils.render.RenderPolicy deciding if the board is drawn and saved, None for always
+    :param profiler: utils.profiling.StageProfiler recording the time of each stage, None for no profiling
+    :param sampler: utils.profiling.SampledProfiler capturing the cProfile, stage timings and inputs of sampled calls
+    '''
+    name = img_path.replace('\\', '/').split('/')[-1][:-4]
+    capture = start_capture(sampler, name, 'merge')
+    if capture is not None and profiler is None:
+        profiler = capture.profiler
+    with profile_stage(profiler, 'load'):
+        compo_json = load_stage_result(store, name, 'ip', result_root) if compo_path is None else load_result(compo_path)
+        text_json = load_stage_result(store, name, 'ocr', result_root) if text_path is None else load_result(text_path)
 
     # load text and non-text compo
     ele_id = 0
@@ -210,26 +303,45 @@ def merge(img_path, compo_path, text_path, merge_root=None, is_paragraph=False,
         for text in texts:
             text.resize(resize_ratio)
 
-    # check the original detected elements
-    img = cv2.imread(img_path)
-    img_resize = cv2.resize(img, (compo_json['img_shape'][1], compo_json['img_shape'][0]))
-    show_elements(img_resize, texts + compos, show=show, win_name='all elements before merging', wait_key=wait_key)
+    # check the original detected elements, the image is only read if a board is drawn
+    img_shape = (compo_json['img_shape'][0], compo_json['img_shape'][1], 3)
+    img_resize = None
+    if show:
+        img_resize = cv2.resize(cv2.imread(img_path), (img_shape[1], img_shape[0]))
+        show_elements(img_resize, texts + compos, show=show, win_name='all elements before merging', wait_key=wait_key)
 
     # refine elements
-    texts = refine_texts(texts, compo_json['img_shape'])
-    elements = refine_elements(compos, texts)
-    if is_remove_bar:
-        elements = remove_top_bar(elements, img_height=compo_json['img_shape'][0])
-        elements = remove_bottom_bar(elements, img_height=compo_json['img_shape'][0])
-    if is_paragraph:
-        elements = merge_text_line_to_paragraph(elements, max_line_gap=7)
-    reassign_ids(elements)
-    check_containment(elements)
-    board = show_elements(img_resize, elements, show=show, win_name='elements after merging', wait_key=wait_key)
+    with profile_stage(profiler, 'refine'):
+        texts = refine_texts(texts, compo_json['img_shape'])
+        elements = refine_elements(compos, texts)
+        if is_remove_bar:
+            elements = remove_top_bar(elements, img_height=compo_json['img_shape'][0])
+            elements = remove_bottom_bar(elements, img_height=compo_json['img_shape'][0])
+        if is_paragraph:
+            elements = merge_text_line_to_paragraph(elements, max_line_gap=7)
+        reassign_ids(elements)
+    with profile_stage(profiler, 'containment'):
+        check_containment(elements)
+    rendered = should_render(render, name, error=len(elements) == 0)
+    board = None
+    if show or rendered:
+        with profile_stage(profiler, 'draw'):
+            if img_resize is None:
+                img_resize = cv2.resize(cv2.imread(img_path), (img_shape[1], img_shape[0]))
+            board = show_elements(img_resize, elements, show=show, win_name='elements after merging', wait_key=wait_key)
 
     # save all merged elements, clips and blank background
-    name = img_path.replace('\\', '/').split('/')[-1][:-4]
-    components = save_elements(pjoin(merge_root, name + '.json'), elements, img_resize.shape)
-    cv2.imwrite(pjoin(merge_root, name + '.jpg'), board)
-    print('[Merge Completed] Input: %s Output: %s' % (img_path, pjoin(merge_root, name + '.jpg')))
+    with profile_stage(profiler, 'save'):
+        if store is not None:
+            components = wrap_elements(elements, img_shape, nested=nested)
+            store.put(name, 'merge', components, board if rendered else None)
+            output = '%s [%s]' % (store.db_path, name)
+        else:
+            components = save_elements(pjoin(merge_root, name + '.json'), elements, img_shape, nested=nested)
+            output = pjoin(merge_root, name + '.json')
+            if rendered:
+                cv2.imwrite(pjoin(merge_root, name + '.jpg'), board)
+                output += ' ' + pjoin(merge_root, name + '.jpg')
+    finish_capture(capture, [compo_json, text_json], profiler)
+    print('[Merge Completed] Input: %s Output: %s' % (img_path, output))
     return board, components
@@ -105,62 +105,27 @@ class Text:
         self.word_width = self.width / len(self.content)
 
     def shrink_bound(self, binary_map):
+        '''
+        Shrink the box to the rows and columns holding foreground of the binary map
+        '''
         bin_clip = binary_map[self.location['top']:self.location['bottom'], self.location['left']:self.location['right']]
         height, width = np.shape(bin_clip)
+        rows = np.flatnonzero(bin_clip.any(axis=1))
+        cols = np.flatnonzero(bin_clip.any(axis=0))
+        self.shrink_to_projection(rows, cols, height, width)
 
-        shrink_top = 0
-        shrink_bottom = 0
-        for i in range(height):
-            # top
-            if shrink_top == 0:
-                if sum(bin_clip[i]) == 0:
-                    shrink_top = 1
-                else:
-                    shrink_top = -1
-            elif shrink_top == 1:
-                if sum(bin_clip[i]) != 0:
-                    self.location['top'] += i
-                    shrink_top = -1
-            # bottom
-            if shrink_bottom == 0:
-                if sum(bin_clip[height-i-1]) == 0:
-                    shrink_bottom = 1
-                else:
-                    shrink_bottom = -1
-            elif shrink_bottom == 1:
-                if sum(bin_clip[height-i-1]) != 0:
-                    self.location['bottom'] -= i
-                    shrink_bottom = -1
-
-            if shrink_top == -1 and shrink_bottom == -1:
-                break
-
-        shrink_left = 0
-        shrink_right = 0
-        for j in range(width):
-            # left
-            if shrink_left == 0:
-                if sum(bin_clip[:, j]) == 0:
-                    shrink_left = 1
-                else:
-                    shrink_left = -1
-            elif shrink_left == 1:
-                if sum(bin_clip[:, j]) != 0:
-                    self.location['left'] += j
-                    shrink_left = -1
-            # right
-            if shrink_right == 0:
-                if sum(bin_clip[:, width-j-1]) == 0:
-                    shrink_right = 1
-                else:
-                    shrink_right = -1
-            elif shrink_right == 1:
-                if sum(bin_clip[:, width-j-1]) != 0:
-                    self.location['right'] -= j
-                    shrink_right = -1
-
-            if shrink_left == -1 and shrink_right == -1:
-                break
+    def shrink_to_projection(self, rows, cols, height, width):
+        '''
+        :param rows, cols: indices of the non-empty rows and columns of the clip of the box
+        :param height, width: shape of the clip, the box clipped to the map
+        '''
+        # no foreground, keep the box
+        if len(rows) == 0:
+            return
+        self.location['top'] += int(rows[0])
+        self.location['bottom'] -= int(height - 1 - rows[-1])
+        self.location['left'] += int(cols[0])
+        self.location['right'] -= int(width - 1 - cols[-1])
         self.width = self.location['right'] - self.location['left']
         self.height = self.location['bottom'] - self.location['top']
         self.area = self.width * self.height
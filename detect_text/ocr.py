@@ -2,8 +2,11 @@ import cv2
 import os
 import requests
 import json
+import threading
 from base64 import b64encode
 import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 
 def Google_OCR_makeImageData(imgpath):
@@ -23,7 +26,7 @@ def Google_OCR_makeImageData(imgpath):
 
 
 def ocr_detection_google(imgpath):
-    start = time.clock()
+    start = time.time()
     url = 'https://vision.googleapis.com/v1/images:annotate'
     api_key = ''             # *** Replace with your own Key ***
     imgdata = Google_OCR_makeImageData(imgpath)
@@ -31,7 +34,7 @@ def ocr_detection_google(imgpath):
                              data=imgdata,
                              params={'key': api_key},
                              headers={'Content_Type': 'application/json'})
-    # print('*** Text Detection Time Taken:%.3fs ***' % (time.clock() - start))
+    # print('*** Text Detection Time Taken:%.3fs ***' % (time.time() - start))
     print("*** Please replace the Google OCR key at detect_text/ocr.py line 28 with your own (apply in https://cloud.google.com/vision) ***")
     if 'responses' not in response.json():
         raise Exception(response.json())
@@ -40,3 +43,132 @@ def ocr_detection_google(imgpath):
         return None
     else:
         return response.json()['responses'][0]['textAnnotations'][1:]
+
+
+def crop_text_box(img, box):
+    '''
+    Cut the quadrilateral box of a text out of the image and warp it to a horizontal rectangle, as PaddleOCR does
+    :param box: 4 corner points clockwise from the top left
+    '''
+    box = np.array(box, dtype=np.float32)
+    width = int(max(np.linalg.norm(box[0] - box[1]), np.linalg.norm(box[2] - box[3])))
+    height = int(max(np.linalg.norm(box[0] - box[3]), np.linalg.norm(box[1] - box[2])))
+    target = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    crop = cv2.warpPerspective(img, cv2.getPerspectiveTransform(box, target), (width, height),
+                               borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC)
+    # vertical text is read rotated
+    if crop.shape[0] >= crop.shape[1] * 1.5:
+        crop = np.rot90(crop)
+    return crop
+
+
+class PaddleOCRBackend:
+    '''
+    A resident PaddleOCR model, built once and reused for every image
+    - takes decoded BGR images (paths are read first)
+    - ocr_batch detects the texts image by image, then classifies and recognizes the crops of all the images
+      together, rec_batch_num crops per forward pass
+    - the predictors are not thread safe, the calls are serialized
+    The results are lines [box points, (content, score)] as PaddleOCR.ocr returns them
+    '''
+    def __init__(self, lang='ch', use_angle_cls=True, rec_batch_num=16, model=None, **kwargs):
+        '''
+        :param lang: language of the recognition model, e.g. 'ch', 'en', 'japan'
+        :param model: an already built PaddleOCR, the other parameters are then ignored
+        :param kwargs: other parameters of PaddleOCR, e.g. use_gpu, det_model_dir, rec_model_dir
+        '''
+        if model is None:
+            from paddleocr import PaddleOCR
+            kwargs.setdefault('show_log', False)
+            model = PaddleOCR(use_angle_cls=use_angle_cls, lang=lang, rec_batch_num=rec_batch_num, **kwargs)
+        self.model = model
+        self.use_angle_cls = use_angle_cls
+        self.lock = threading.Lock()
+
+    def detect(self, img):
+        '''
+        :return: boxes of the texts in reading order, top to bottom then left to right
+        '''
+        boxes, _ = self.model.text_detector(img)
+        if boxes is None:
+            return []
+        return sorted([np.array(box) for box in boxes], key=lambda box: (box[0][1], box[0][0]))
+
+    def recognize(self, crops):
+        '''
+        :return: (content, score) of each crop
+        '''
+        if len(crops) == 0:
+            return []
+        if self.use_angle_cls and getattr(self.model, 'text_classifier', None) is not None:
+            crops, _, _ = self.model.text_classifier(crops)
+        results, _ = self.model.text_recognizer(crops)
+        return results
+
+    def ocr_batch(self, imgs):
+        '''
+        :param imgs: list of BGR images or image paths
+        :return: list of the text lines of each image
+        '''
+        imgs = [cv2.imread(img) if isinstance(img, str) else img for img in imgs]
+        with self.lock:
+            boxes = [self.detect(img) for img in imgs]
+            crops = [crop_text_box(img, box) for img, img_boxes in zip(imgs, boxes) for box in img_boxes]
+            results = self.recognize(crops)
+        drop_score = getattr(self.model, 'drop_score', 0.5)
+        lines, i = [], 0
+        for img_boxes in boxes:
+            img_lines = []
+            for box in img_boxes:
+                content, score = results[i]
+                i += 1
+                if score >= drop_score:
+                    img_lines.append([box.tolist(), (content, score)])
+            lines.append(img_lines)
+        return lines
+
+    def ocr(self, img):
+        return self.ocr_batch([img])[0]
+
+    def recognize_crops(self, crops):
+        '''
+        Recognition only, of text crops cut out by the caller, in batches of rec_batch_num
+        :return: (content, score) of each crop, the content is empty below the drop score
+        '''
+        with self.lock:
+            results = self.recognize(crops)
+        drop_score = getattr(self.model, 'drop_score', 0.5)
+        return [(content, score) if score >= drop_score else ('', score) for content, score in results]
+
+
+_paddle_backends = {}
+_paddle_lock = threading.Lock()
+
+
+def get_paddle_backend(lang='ch', **kwargs):
+    '''
+    The PaddleOCRBackend of this process for the language and parameters, built on the first call
+    '''
+    key = (lang, tuple(sorted(kwargs.items())))
+    with _paddle_lock:
+        if key not in _paddle_backends:
+            _paddle_backends[key] = PaddleOCRBackend(lang=lang, **kwargs)
+        return _paddle_backends[key]
+
+
+def ocr_tesseract_crops(crops, lang='eng', workers=4):
+    '''
+    Recognize text crops of single lines through Tesseract, each tesseract call is a process so threads run them in parallel
+    :return: (content, score) of each crop, score the mean confidence of its words in [0, 1]
+    '''
+    import pytesseract as pyt
+
+    def recognize(crop):
+        data = pyt.image_to_data(crop, lang=lang, config='--psm 7', output_type=pyt.Output.DICT)
+        words = [(word, float(conf)) for word, conf in zip(data['text'], data['conf']) if word.strip() != '' and float(conf) >= 0]
+        if len(words) == 0:
+            return '', 0
+        return ' '.join(word for word, _ in words), sum(conf for _, conf in words) / len(words) / 100
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(recognize, crops))
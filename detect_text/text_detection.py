@@ -1,15 +1,19 @@
 import detect_text.ocr as ocr
 from detect_text.Text import Text
+import detect_compo.lib_ip.ip_detection as det
+import detect_compo.lib_ip.ip_preprocessing as pre
+import detect_compo.lib_ip.Component as Compo
+from utils.element_store import save_result
+from utils.render import should_render
+from utils.profiling import profile_stage, start_capture, finish_capture
 import numpy as np
 import cv2
-import json
 import time
 import os
 from os.path import join as pjoin
 
 
-def save_detection_json(file_path, texts, img_shape):
-    f_out = open(file_path, 'w')
+def wrap_texts(texts, img_shape):
     output = {'img_shape': img_shape, 'texts': []}
     for text in texts:
         c = {'id': text.id, 'content': text.content}
@@ -18,7 +22,16 @@ def save_detection_json(file_path, texts, img_shape):
         c['width'] = text.width
         c['height'] = text.height
         output['texts'].append(c)
-    json.dump(output, f_out, indent=4)
+    return output
+
+
+def save_detection_json(file_path, texts, img_shape):
+    '''
+    :param file_path: .npz for the packed format, JSON otherwise
+    '''
+    output = wrap_texts(texts, img_shape)
+    save_result(file_path, output)
+    return output
 
 
 def visualize_texts(org_img, texts, shown_resize_height=None, show=False, write_path=None):
@@ -36,6 +49,7 @@ def visualize_texts(org_img, texts, shown_resize_height=None, show=False, write_
         cv2.destroyWindow('texts')
     if write_path is not None:
         cv2.imwrite(write_path, img)
+    return img
 
 
 def text_sentences_recognition(texts):
@@ -118,6 +132,17 @@ def text_cvt_orc_format_paddle(paddle_result):
     return texts
 
 
+def texts_shrink_bound(texts, binary_map):
+    '''
+    Shrink the boxes of all texts of a screen to the foreground of the binary map
+    The map is turned into a boolean mask once, the projections of each box are then reductions over its clip only
+    '''
+    foreground = binary_map if binary_map.dtype == bool else binary_map != 0
+    for text in texts:
+        text.shrink_bound(foreground)
+    return texts
+
+
 def text_filter_noise(texts):
     valid_texts = []
     for text in texts:
@@ -127,38 +152,170 @@ def text_filter_noise(texts):
     return valid_texts
 
 
-def text_detection(input_file='../data/input/30800.jpg', output_file='../data/output', show=False, method='google', paddle_model=None):
+def text_detection(input_file='../data/input/30800.jpg', output_file='../data/output', show=False, method='google', paddle_model=None,
+                   store=None, render=None, profiler=None, sampler=None, shrink_grad_min=None):
     '''
     :param method: google or paddle
-    :param paddle_model: the preload paddle model for paddle ocr
+    :param paddle_model: detect_text.ocr.PaddleOCRBackend (or PaddleOCR) preloaded for paddle ocr, the resident
+                         backend of the process is used if None
+    :param store: if given, a utils.result_store.ResultStore receiving the result and its board
+                  in place of the files under output_file/ocr
+    :param render: utils.render.RenderPolicy deciding if the board is drawn and saved, None for always
+    :param profiler: utils.profiling.StageProfiler recording the time of each stage, None for no profiling
+    :param sampler: utils.profiling.SampledProfiler capturing the cProfile, stage timings and input of sampled calls
+    :param shrink_grad_min: if given, the text boxes are shrunk to the foreground of the binary map of this gradient threshold
     '''
-    start = time.clock()
+    start = time.time()
     name = input_file.split('/')[-1][:-4]
+    capture = start_capture(sampler, name, 'ocr')
+    if capture is not None and profiler is None:
+        profiler = capture.profiler
     ocr_root = pjoin(output_file, 'ocr')
-    img = cv2.imread(input_file)
+    with profile_stage(profiler, 'read'):
+        img = cv2.imread(input_file)
 
     if method == 'google':
         print('*** Detect Text through Google OCR ***')
-        ocr_result = ocr.ocr_detection_google(input_file)
-        texts = text_cvt_orc_format(ocr_result)
-        texts = merge_intersected_texts(texts)
-        texts = text_filter_noise(texts)
-        texts = text_sentences_recognition(texts)
+        with profile_stage(profiler, 'ocr'):
+            ocr_result = ocr.ocr_detection_google(input_file)
+        with profile_stage(profiler, 'text_merge'):
+            texts = text_cvt_orc_format(ocr_result)
+            texts = merge_intersected_texts(texts)
+            texts = text_filter_noise(texts)
+            texts = text_sentences_recognition(texts)
     elif method == 'paddle':
-        # The import of the paddle ocr can be separate to the beginning of the program if you decide to use this method
-        from paddleocr import PaddleOCR
         print('*** Detect Text through Paddle OCR ***')
-        if paddle_model is None:
-            paddle_model = PaddleOCR(use_angle_cls=True, lang="ch")
-        result = paddle_model.ocr(input_file, cls=True)
-        texts = text_cvt_orc_format_paddle(result)
+        paddle_model = paddle_backend(paddle_model)
+        with profile_stage(profiler, 'ocr'):
+            result = paddle_model.ocr(img)
+        with profile_stage(profiler, 'text_merge'):
+            texts = text_cvt_orc_format_paddle(result)
     else:
         raise ValueError('Method has to be "google" or "paddle"')
 
-    visualize_texts(img, texts, shown_resize_height=800, show=show, write_path=pjoin(ocr_root, name+'.png'))
+    if shrink_grad_min is not None:
+        with profile_stage(profiler, 'shrink'):
+            texts_shrink_bound(texts, pre.binarization(img, shrink_grad_min))
+
+    with profile_stage(profiler, 'save'):
+        output = save_texts(name, img, texts, ocr_root, show, store, render)
+    finish_capture(capture, [input_file], profiler)
+    print("[Text Detection Completed in %.3f s] Input: %s Output: %s" % (time.time() - start, input_file, output))
+
+
+def save_texts(name, img, texts, ocr_root, show=False, store=None, render=None):
+    '''
+    Save the texts of an image and its board if rendered, to the store or under ocr_root
+    :return: description of the output
+    '''
+    rendered = should_render(render, name, error=len(texts) == 0)
+    if store is not None:
+        board = visualize_texts(img, texts, shown_resize_height=800, show=show) if show or rendered else None
+        store.put(name, 'ocr', wrap_texts(texts, img.shape), board if rendered else None)
+        return '%s [%s]' % (store.db_path, name)
+    if show or rendered:
+        visualize_texts(img, texts, shown_resize_height=800, show=show, write_path=pjoin(ocr_root, name+'.png') if rendered else None)
     save_detection_json(pjoin(ocr_root, name+'.json'), texts, img.shape)
-    print("[Text Detection Completed in %.3f s] Input: %s Output: %s" % (time.clock() - start, input_file, pjoin(ocr_root, name+'.json')))
+    return pjoin(ocr_root, name+'.json')
+
+
+def paddle_backend(paddle_model=None):
+    if paddle_model is None:
+        return ocr.get_paddle_backend()
+    if not isinstance(paddle_model, ocr.PaddleOCRBackend):
+        # a PaddleOCR built by the caller
+        return ocr.PaddleOCRBackend(model=paddle_model)
+    return paddle_model
+
+
+def text_detection_paddle_batch(input_files, output_file='../data/output', paddle_model=None, batch_size=8, store=None, render=None):
+    '''
+    Detect the texts of several images through Paddle OCR, recognizing the text crops of batch_size images together
+    :param input_files: image paths
+    :param paddle_model: detect_text.ocr.PaddleOCRBackend, the resident backend of the process is used if None
+    '''
+    paddle_model = paddle_backend(paddle_model)
+    ocr_root = pjoin(output_file, 'ocr')
+    for begin in range(0, len(input_files), batch_size):
+        start = time.time()
+        batch = input_files[begin: begin + batch_size]
+        imgs = [cv2.imread(input_file) for input_file in batch]
+        results = paddle_model.ocr_batch(imgs)
+        for input_file, img, result in zip(batch, imgs, results):
+            name = input_file.replace('\\', '/').split('/')[-1][:-4]
+            save_texts(name, img, text_cvt_orc_format_paddle(result), ocr_root, store=store, render=render)
+        print("[Text Detection Completed in %.3f s] Input: %d images from %s" % (time.time() - start, len(batch), batch[0]))
 
 
 # text_detection()
 
+
+def text_candidates(compos, binary, max_height=30, max_word_gap=4, min_fill=0.1, max_fill=0.9):
+    '''
+    Select the likely text regions: the low compos merged into lines by det.merge_text, kept if the share of
+    foreground pixels of the binary map in them is that of glyphs rather than of an empty or solid box
+    :param compos: compos of compo_detection, on the image of the binary map
+    :return: list of (col_min, row_min, col_max, row_max) on the binary map
+    '''
+    low = Compo.compos_copy([compo for compo in compos if compo.height <= max_height])
+    lines = det.merge_text(low, binary.shape, max_word_gad=max_word_gap, max_word_height=max_height)
+    boxes = []
+    for line in lines:
+        col_min, row_min, col_max, row_max = line.put_bbox()
+        clip = binary[row_min: row_max + 1, col_min: col_max + 1]
+        if clip.size > 0 and min_fill <= np.count_nonzero(clip) / clip.size <= max_fill:
+            boxes.append((col_min, row_min, col_max, row_max))
+    return boxes
+
+
+def text_detection_on_compos(input_file, compos, output_file='../data/output', binary=None, grad_min=10, recognizer='tesseract',
+                             paddle_model=None, lang=None, workers=4, pad=2, show=False, store=None, render=None, profiler=None):
+    '''
+    Local ocr recognizing only the likely text regions among the compos, no full-page text detection and no network
+    :param compos: output of compo_detection on this image
+    :param binary: binary map of the compo detection, computed from the image resized as the compos if None
+    :param grad_min: min-grad of the compo detection, to compute the binary map
+    :param recognizer: 'tesseract', or 'paddle' for the recognition only of Paddle OCR
+    :param paddle_model: detect_text.ocr.PaddleOCRBackend, the resident backend of the process for lang is used if None
+    :param lang: language of the recognizer, 'eng' for tesseract and 'ch' for paddle if None
+    :param workers: tesseract processes run in parallel
+    :param pad: pixels kept around the regions, on the image of the compos
+    '''
+    start = time.time()
+    name = input_file.replace('\\', '/').split('/')[-1][:-4]
+    ocr_root = pjoin(output_file, 'ocr')
+    with profile_stage(profiler, 'read'):
+        img = cv2.imread(input_file)
+
+    # the compos are on the resized image, the regions are cut out of the original one
+    with profile_stage(profiler, 'candidates'):
+        compo_shape = compos[0].image_shape if len(compos) > 0 else img.shape
+        if binary is None:
+            binary = pre.binarization(cv2.resize(img, (compo_shape[1], compo_shape[0])), grad_min)
+        ratio = img.shape[0] / compo_shape[0]
+        locations = []
+        for col_min, row_min, col_max, row_max in text_candidates(compos, binary):
+            locations.append({'left': max(int((col_min - pad) * ratio), 0), 'top': max(int((row_min - pad) * ratio), 0),
+                              'right': min(int((col_max + pad) * ratio), img.shape[1]), 'bottom': min(int((row_max + pad) * ratio), img.shape[0])})
+        crops = [img[loc['top']: loc['bottom'], loc['left']: loc['right']] for loc in locations]
+
+    with profile_stage(profiler, 'ocr'):
+        if recognizer == 'tesseract':
+            results = ocr.ocr_tesseract_crops(crops, lang='eng' if lang is None else lang, workers=workers)
+        elif recognizer == 'paddle':
+            if paddle_model is None:
+                paddle_model = ocr.get_paddle_backend(lang='ch' if lang is None else lang)
+            results = paddle_backend(paddle_model).recognize_crops(crops)
+        else:
+            raise ValueError('Recognizer has to be "tesseract" or "paddle"')
+
+    with profile_stage(profiler, 'text_merge'):
+        texts = [Text(i, content.strip(), location) for i, (location, (content, _)) in enumerate(zip(locations, results))
+                 if len(content.strip()) > 0]
+        texts = text_filter_noise(texts)
+        for i, text in enumerate(texts):
+            text.id = i
+    with profile_stage(profiler, 'save'):
+        output = save_texts(name, img, texts, ocr_root, show, store, render)
+    print("[Text Detection Completed in %.3f s] Input: %s Output: %s" % (time.time() - start, input_file, output))
+    return texts
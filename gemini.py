@@ -13,6 +13,8 @@ from selenium.webdriver.common.actions import interaction
 from selenium.webdriver.common.actions.action_builder import ActionBuilder
 from selenium.webdriver.common.actions.pointer_input import PointerInput
 
+from utils.screen_cache import default_cache
+
 # --- Configuration ---
 GEMINI_API_KEY = ""  # Replace with your actual Gemini API key
 RUNNER_APP_PATH = "/Users/pkamra/Library/Developer/Xcode/DerivedData/Runner-cznhzcttjkmrrggdodjdqsvdstuf/Build/Products/Debug-iphonesimulator/Runner.app"  # Replace with the actual path to your Runner.app
@@ -40,6 +42,9 @@ safety_settings = [
 model = GenerativeModel(model_name="gemini-2.0-flash", generation_config=generation_config,
                         safety_settings=safety_settings)
 
+# Analyses of known screens are reused instead of querying Gemini again
+screen_cache = default_cache()
+
 
 
 # --- Helper Functions ---
@@ -246,6 +251,11 @@ Provide your analysis in a JSON format like this:
 ]
 """
 
+    cache_key = screen_cache.screen_key("ios_screenshot.png", tag='gemini:%s:%s:%s' % (language, screen_dim, user_steps))
+    cached = screen_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
         response = model.generate_content(contents=[Image.open("ios_screenshot.png"), prompt])
         # print(current_screen_base64 is None)
@@ -287,6 +297,7 @@ Provide your analysis in a JSON format like this:
         analysis_json_str = analysis_json_str.strip()
         try:
             analysis = json.loads(analysis_json_str)
+            screen_cache.put(cache_key, analysis)
             return analysis
         except json.JSONDecodeError:
             print(f"Error decoding Gemini response as JSON: {analysis_json_str}")
@@ -0,0 +1,91 @@
+import os
+import sys
+from glob import glob
+from os.path import join as pjoin
+
+try:
+    from utils.element_store import load_result, read_shards
+    from utils.result_store import ResultStore
+except ImportError:
+    # run as a script from result_processing
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from utils.element_store import load_result, read_shards
+    from utils.result_store import ResultStore
+
+
+def iter_detect_results(result_root):
+    '''
+    :param result_root: directory of per-image results (.json or packed .npz), or of the shard-*.npz of a ShardedWriter
+    :return: generator of (image name, result)
+    '''
+    if len(glob(pjoin(result_root, 'shard-*.npz'))) > 0:
+        for name, result in read_shards(result_root):
+            yield name, result
+        return
+    result_files = sorted(glob(pjoin(result_root, '*.json')) + glob(pjoin(result_root, '*.npz')))
+    print('Loading %d detection results' % len(result_files))
+    for result_file in result_files:
+        yield result_file.replace('\\', '/').split('/')[-1].split('.')[0], load_result(result_file)
+
+
+def iter_store_results(db_path, stage='merge'):
+    '''
+    :param db_path: results.db of a run, see utils.result_store.ResultStore
+    :return: generator of (image name, result) of the stage, read from the store in batches
+    '''
+    if not os.path.exists(db_path):
+        raise ValueError('No result store at %s' % db_path)
+    store = ResultStore(db_path)
+    try:
+        for name, result in store.iter_results(stage):
+            yield name, result
+    finally:
+        store.close()
+
+
+def compo_boxes(result):
+    '''
+    :return: list of ((col_min, row_min, col_max, row_max), category) of the compos of an ip or merge result
+    '''
+    boxes = []
+    for compo in result['compos']:
+        # merge results keep the box under 'position'
+        pos = compo.get('position', compo)
+        boxes.append(((pos['column_min'], pos['row_min'], pos['column_max'], pos['row_max']),
+                      compo.get('category', compo.get('class'))))
+    return boxes
+
+
+def reform_detect_results(results, shrink=4):
+    '''
+    Keep the compos of at least 10x10 outside the top and bottom bars, shrunk by shrink on each side
+    :param results: iterable of (image name, result)
+    :return: {image name: {'bboxes', 'categories'}}
+    '''
+    def is_bottom_or_top(corner):
+        column_min, row_min, column_max, row_max = corner
+        if row_max < 36 or row_min > 725:
+            return True
+        return False
+
+    compos_reform = {}
+    for img_name, result in results:
+        for (column_min, row_min, column_max, row_max), category in compo_boxes(result):
+            if column_max - column_min < 10 or row_max - row_min < 10:
+                continue
+            if is_bottom_or_top((column_min, row_min, column_max, row_max)):
+                continue
+            if img_name not in compos_reform:
+                compos_reform[img_name] = {'bboxes': [], 'categories': []}
+            compos_reform[img_name]['bboxes'].append([column_min + shrink, row_min + shrink, column_max - shrink, row_max - shrink])
+            compos_reform[img_name]['categories'].append(category)
+    return compos_reform
+
+
+def resize_label(bboxes, d_height, gt_height, bias=0):
+    bboxes_new = []
+    scale = gt_height / d_height
+    for bbox in bboxes:
+        bbox = [int(b * scale + bias) for b in bbox]
+        bboxes_new.append(bbox)
+    return bboxes_new
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def overlap_matrix(d_bboxes, gt_bboxes):
+    '''
+    :param d_bboxes: detected [[col_min, row_min, col_max, row_max]]
+    :param gt_bboxes: ground truth [[col_min, row_min, col_max, row_max]]
+    :return: intersection area, iou and iod (intersection over detection) matrices of shape (#detected, #ground truth)
+    '''
+    d = np.array(d_bboxes, dtype=np.int64).reshape(-1, 4)
+    gt = np.array(gt_bboxes, dtype=np.int64).reshape(-1, 4)
+    area_d = (d[:, 2] - d[:, 0]) * (d[:, 3] - d[:, 1])
+    area_gt = (gt[:, 2] - gt[:, 0]) * (gt[:, 3] - gt[:, 1])
+    w = np.maximum(0, np.minimum(d[:, None, 2], gt[None, :, 2]) - np.maximum(d[:, None, 0], gt[None, :, 0]))
+    h = np.maximum(0, np.minimum(d[:, None, 3], gt[None, :, 3]) - np.maximum(d[:, None, 1], gt[None, :, 1]))
+    inter = w * h
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = np.where(inter > 0, inter / (area_d[:, None] + area_gt[None, :] - inter), 0)
+        iod = np.where(inter > 0, inter / area_d[:, None], 0)
+    return inter, iou, iod
+
+
+def match_bboxes(d_bboxes, gt_bboxes, d_categories=None, gt_categories=None, method='greedy', iou_min=0.9):
+    '''
+    A detected box matches a ground truth box if they intersect with iou > iou_min or the detected box is inside it,
+    and if categories are given, they share the category
+    :param method: 'greedy': each detected box in order takes the first unmatched ground truth it matches
+                   'hungarian': the one-to-one assignment of matched pairs maximizing the total iou (needs scipy)
+    :return: index of the ground truth matched by each detected box or -1,
+             boolean array marking the matched ground truth
+    '''
+    inter, iou, iod = overlap_matrix(d_bboxes, gt_bboxes)
+    valid = (inter > 0) & ((iou > iou_min) | (iod == 1))
+    if d_categories is not None and gt_categories is not None:
+        valid &= np.array(d_categories, dtype=object)[:, None] == np.array(gt_categories, dtype=object)[None, :]
+
+    d_match = np.full(len(inter), -1, dtype=int)
+    gt_matched = np.zeros(inter.shape[1], dtype=bool)
+    if method == 'greedy':
+        for i in np.flatnonzero(valid.any(axis=1)):
+            candidates = np.flatnonzero(valid[i] & ~gt_matched)
+            if len(candidates) > 0:
+                d_match[i] = candidates[0]
+                gt_matched[candidates[0]] = True
+    elif method == 'hungarian':
+        from scipy.optimize import linear_sum_assignment
+        rows, cols = linear_sum_assignment(np.where(valid, -iou, 1))
+        for i, j in zip(rows, cols):
+            if valid[i, j]:
+                d_match[i] = j
+                gt_matched[j] = True
+    else:
+        raise ValueError('Method has to be "greedy" or "hungarian"')
+    return d_match, gt_matched
+
+
+def size_level(width):
+    '''
+    :return: 0: small, 1: medium, 2: large, -1 (counted as large) for the widths 64 and 128
+    '''
+    if width < 64:
+        return 0
+    elif 64 < width < 128:
+        return 1
+    elif width > 128:
+        return 2
+    return -1
+
+
+def score_image(d_bboxes, d_categories, gt_bboxes, gt_categories, match_category=False, method='greedy'):
+    '''
+    :param match_category: if True, a detected box only matches ground truth of the same category
+    :return: metric record of the image:
+             {'TP', 'FP', 'FN', 'class': {category: [TP, FP, FN]}, 'size': [[TP, FP, FN] of each size level]}
+             TP and FN are counted to the category and size of the ground truth, FP to those of the detected box
+    '''
+    if match_category:
+        d_match, gt_matched = match_bboxes(d_bboxes, gt_bboxes, d_categories, gt_categories, method=method)
+    else:
+        d_match, gt_matched = match_bboxes(d_bboxes, gt_bboxes, method=method)
+    record = {'TP': 0, 'FP': 0, 'FN': 0, 'class': {}, 'size': [[0, 0, 0], [0, 0, 0], [0, 0, 0]]}
+
+    def count(kind, category, bbox):
+        record[kind] += 1
+        k = ('TP', 'FP', 'FN').index(kind)
+        record['class'].setdefault(str(category), [0, 0, 0])[k] += 1
+        record['size'][size_level(bbox[2] - bbox[0])][k] += 1
+
+    for j, d_bbox in enumerate(d_bboxes):
+        if d_match[j] >= 0:
+            count('TP', gt_categories[d_match[j]], gt_bboxes[d_match[j]])
+        else:
+            count('FP', d_categories[j], d_bbox)
+    for k in np.flatnonzero(~gt_matched):
+        count('FN', gt_categories[k], gt_bboxes[k])
+    return record
+
+
+class MetricAccumulator:
+    '''
+    Sum of the metric records of images, accumulators of separate image sets are combined by merge
+    '''
+    def __init__(self):
+        self.images = 0
+        self.TP, self.FP, self.FN = 0, 0, 0
+        self.classes = {}
+        self.sizes = [[0, 0, 0], [0, 0, 0], [0, 0, 0]]
+
+    def add(self, record):
+        self.images += 1
+        self.add_counts(record['TP'], record['FP'], record['FN'], record['class'], record['size'])
+
+    def add_counts(self, TP, FP, FN, classes, sizes):
+        self.TP += TP
+        self.FP += FP
+        self.FN += FN
+        for category, counts in classes.items():
+            total = self.classes.setdefault(category, [0, 0, 0])
+            for k in range(3):
+                total[k] += counts[k]
+        for level in range(3):
+            for k in range(3):
+                self.sizes[level][k] += sizes[level][k]
+
+    def merge(self, other):
+        self.images += other.images
+        self.add_counts(other.TP, other.FP, other.FN, other.classes, other.sizes)
+
+    @staticmethod
+    def scores(TP, FP, FN):
+        '''
+        :return: precision, recall, f1, 0 if undefined
+        '''
+        precision = TP / (TP + FP) if TP + FP > 0 else 0
+        recall = TP / (TP + FN) if TP + FN > 0 else 0
+        f1 = 2 * (precision * recall) / (precision + recall) if precision + recall > 0 else 0
+        return precision, recall, f1
+
+    def report(self):
+        precision, recall, f1 = self.scores(self.TP, self.FP, self.FN)
+        print('[%d images] TP:%d, FP:%d, FN:%d, Precesion:%.3f, Recall:%.3f, F1:%.3f' % (
+            self.images, self.TP, self.FP, self.FN, precision, recall, f1))
+        for category in sorted(self.classes):
+            print('    %s: Precesion:%.3f, Recall:%.3f, F1:%.3f' % ((category,) + self.scores(*self.classes[category])))
+        for level, name in enumerate(['small', 'medium', 'large']):
+            print('    %s: Precesion:%.3f, Recall:%.3f, F1:%.3f' % ((name,) + self.scores(*self.sizes[level])))
+
+
+def score_chunk(items, match_category, method):
+    return [(image_id, score_image(*pair, match_category=match_category, method=method)) for image_id, pair in items]
+
+
+def score_images(pairs, workers=None, cache_file=None, match_category=False, method='greedy', chunk_size=200):
+    '''
+    Score images on a process pool, reusing the cached records of the images whose boxes are unchanged
+    :param pairs: {image id: (detected bboxes, detected categories, ground truth bboxes, ground truth categories)}
+    :param workers: number of processes, None or 1 to score in this process
+    :param cache_file: pickle file of the records of earlier runs, updated with the new records
+    :return: {image id: metric record}
+    '''
+    cache = {}
+    if cache_file is not None and os.path.exists(cache_file):
+        cache = pickle.load(open(cache_file, 'rb'))
+
+    records, todo, digests = {}, [], {}
+    for image_id, pair in pairs.items():
+        digest = hashlib.md5(json.dumps([pair, match_category, method], default=str).encode('utf-8')).hexdigest()
+        if image_id in cache and cache[image_id][0] == digest:
+            records[image_id] = cache[image_id][1]
+        else:
+            digests[image_id] = digest
+            todo.append((image_id, pair))
+    print('Scoring %d images, %d reused' % (len(todo), len(records)))
+
+    chunks = [todo[k:k + chunk_size] for k in range(0, len(todo), chunk_size)]
+    if workers is None or workers <= 1:
+        results = [score_chunk(chunk, match_category, method) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(score_chunk, chunks, [match_category] * len(chunks), [method] * len(chunks)))
+    for chunk_records in results:
+        for image_id, record in chunk_records:
+            records[image_id] = record
+            cache[image_id] = (digests[image_id], record)
+
+    if cache_file is not None and len(todo) > 0:
+        pickle.dump(cache, open(cache_file, 'wb'))
+    return records
+
+
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+
+def match_by_score(d_bboxes, d_scores, gt_bboxes, iou_thresholds=IOU_THRESHOLDS):
+    '''
+    COCO-style matching at all thresholds at once: the detected boxes in descending score each take
+    the unmatched ground truth of the highest iou, if the iou reaches the threshold
+    :return: boolean array (#thresholds, #detected) marking the true positives, in the order of d_bboxes
+    '''
+    tp = np.zeros((len(iou_thresholds), len(d_bboxes)), dtype=bool)
+    if len(d_bboxes) == 0 or len(gt_bboxes) == 0:
+        return tp
+    _, iou, _ = overlap_matrix(d_bboxes, gt_bboxes)
+    matched = np.zeros((len(iou_thresholds), len(gt_bboxes)), dtype=bool)
+    rows = np.arange(len(iou_thresholds))
+    for i in np.argsort(-np.asarray(d_scores, dtype=float), kind='stable'):
+        candidate_iou = np.where(matched | (iou[i][None, :] < iou_thresholds[:, None]), -1, iou[i][None, :])
+        best = candidate_iou.argmax(axis=1)
+        hit = candidate_iou[rows, best] >= 0
+        tp[hit, i] = True
+        matched[rows[hit], best[hit]] = True
+    return tp
+
+
+def average_precision(scores, tp, num_gt):
+    '''
+    101-point interpolated average precision of each threshold
+    :param scores: (N,) scores of all detected boxes of a group across images
+    :param tp: (#thresholds, N) true positive marks of the boxes
+    :return: (#thresholds,) AP, nan if there is no ground truth
+    '''
+    if num_gt == 0:
+        return np.full(tp.shape[0], np.nan)
+    if tp.shape[1] == 0:
+        return np.zeros(tp.shape[0])
+    order = np.argsort(-np.asarray(scores, dtype=float), kind='stable')
+    tp_sum = np.cumsum(tp[:, order], axis=1)
+    fp_sum = np.cumsum(~tp[:, order], axis=1)
+    recall = tp_sum / num_gt
+    precision = tp_sum / (tp_sum + fp_sum)
+    # precision envelope: the best precision at any recall at least as high
+    precision = np.maximum.accumulate(precision[:, ::-1], axis=1)[:, ::-1]
+    recall_points = np.linspace(0, 1, 101)
+    ap = np.zeros(tp.shape[0])
+    for t in range(tp.shape[0]):
+        k = np.searchsorted(recall[t], recall_points, side='left')
+        ap[t] = np.where(k < len(order), precision[t][np.minimum(k, len(order) - 1)], 0).mean()
+    return ap
+
+
+def coco_map(pairs, scores=None, iou_thresholds=IOU_THRESHOLDS):
+    '''
+    AP over the iou thresholds, overall (class-agnostic), by category and by size level
+    - by category: detected and ground truth boxes of the same category are matched
+    - by size level: the boxes of the size level (size_level of their width) are matched, regardless of category
+    :param pairs: {image id: (detected bboxes, detected categories, ground truth bboxes, ground truth categories)}
+    :param scores: {image id: scores of the detected boxes}, the boxes keep their order as scores if not given
+    :return: {'mAP': mean AP of the categories, 'AP', 'AP50', 'AP75': class-agnostic AP,
+              'class': {category: AP}, 'size': {size level: AP}}, AP is averaged over the thresholds unless named
+    '''
+    groups = {}     # group -> [scores, tp, number of ground truth]
+
+    def add(group, d_bboxes, d_scores, gt_bboxes):
+        if group not in groups:
+            groups[group] = [[], [], 0]
+        groups[group][0].append(d_scores)
+        groups[group][1].append(match_by_score(d_bboxes, d_scores, gt_bboxes, iou_thresholds))
+        groups[group][2] += len(gt_bboxes)
+
+    for image_id, (d_bboxes, d_categories, gt_bboxes, gt_categories) in pairs.items():
+        d_bboxes, gt_bboxes = np.array(d_bboxes).reshape(-1, 4), np.array(gt_bboxes).reshape(-1, 4)
+        d_scores = np.asarray(scores[image_id], dtype=float) if scores is not None else -np.arange(len(d_bboxes), dtype=float)
+        d_categories, gt_categories = np.array(d_categories, dtype=str), np.array(gt_categories, dtype=str)
+        add('all', d_bboxes, d_scores, gt_bboxes)
+        for category in set(d_categories.tolist()) | set(gt_categories.tolist()):
+            d_in, gt_in = d_categories == category, gt_categories == category
+            add(('class', category), d_bboxes[d_in], d_scores[d_in], gt_bboxes[gt_in])
+        d_levels = np.array([size_level(w) % 3 for w in d_bboxes[:, 2] - d_bboxes[:, 0]], dtype=int)
+        gt_levels = np.array([size_level(w) % 3 for w in gt_bboxes[:, 2] - gt_bboxes[:, 0]], dtype=int)
+        for level in range(3):
+            d_in, gt_in = d_levels == level, gt_levels == level
+            add(('size', level), d_bboxes[d_in], d_scores[d_in], gt_bboxes[gt_in])
+
+    aps = {}
+    for group, (group_scores, group_tp, num_gt) in groups.items():
+        aps[group] = average_precision(np.concatenate(group_scores), np.concatenate(group_tp, axis=1), num_gt)
+    class_aps = {group[1]: float(np.mean(ap)) for group, ap in aps.items() if group[0] == 'class' and not np.isnan(ap).any()}
+    overall = aps.get('all', np.full(len(iou_thresholds), np.nan))
+    return {'mAP': float(np.mean(list(class_aps.values()))) if len(class_aps) > 0 else float('nan'),
+            'AP': float(np.mean(overall)),
+            'AP50': float(overall[np.argmin(np.abs(iou_thresholds - 0.5))]),
+            'AP75': float(overall[np.argmin(np.abs(iou_thresholds - 0.75))]),
+            'class': class_aps,
+            'size': {level: float(np.mean(aps[('size', level)])) for level in range(3) if ('size', level) in aps}}
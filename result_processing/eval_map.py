@@ -0,0 +1,39 @@
+from evaluation import load_detect_result_json, resize_label
+from eval_classes import load_ground_truth_json
+from eval_core import coco_map
+
+
+def eval_map(detection, ground_truth, no_text=False):
+    '''
+    COCO-style AP over iou 0.5:0.95 of the detection results against the ground truth with class names
+    :param detection: {image id: {'bboxes', 'categories'} and optionally 'scores' of the boxes, e.g. classifier probabilities}
+                      without scores, the boxes are ranked in their saved order
+    '''
+    pairs, scores = {}, {}
+    for image_id in detection:
+        if image_id not in ground_truth:
+            continue
+        d_compos, gt_compos = detection[image_id], ground_truth[image_id]
+        d_keep = [k for k, category in enumerate(d_compos['categories']) if not (no_text and category == 'TextView')]
+        gt_keep = [k for k, category in enumerate(gt_compos['categories']) if not (no_text and category == 'TextView')]
+        d_bboxes = resize_label([d_compos['bboxes'][k] for k in d_keep], 800, gt_compos['size'][0])
+        pairs[image_id] = (d_bboxes, [d_compos['categories'][k] for k in d_keep],
+                           [gt_compos['bboxes'][k] for k in gt_keep], [gt_compos['categories'][k] for k in gt_keep])
+        if 'scores' in d_compos:
+            scores[image_id] = [d_compos['scores'][k] for k in d_keep]
+    result = coco_map(pairs, scores if len(scores) == len(pairs) else None)
+
+    print('[%d images] mAP:%.3f, AP:%.3f, AP50:%.3f, AP75:%.3f' % (len(pairs), result['mAP'], result['AP'], result['AP50'], result['AP75']))
+    for category in sorted(result['class']):
+        print('    %s: AP:%.3f' % (category, result['class'][category]))
+    for level, name in enumerate(['small', 'medium', 'large']):
+        if level in result['size']:
+            print('    %s: AP:%.3f' % (name, result['size'][level]))
+    return result
+
+
+if __name__ == '__main__':
+    no_text = False
+    detect = load_detect_result_json('E:\\Mulong\\Result\\rico\\rico_uied\\rico_new_uied_v3\\merge')
+    gt = load_ground_truth_json('E:\\Mulong\\Datasets\\rico\\instances_test.json')
+    eval_map(detect, gt, no_text=no_text)
@@ -0,0 +1,61 @@
+import json
+import os
+
+import numpy as np
+
+
+def build_ground_truth_index(gt_file):
+    '''
+    Index the COCO-format ground truth by image in one pass over images and annotations
+    :return: dict of arrays, the annotations of image k are rows offset[k]:offset[k+1] of bbox and category
+    '''
+    data = json.load(open(gt_file, 'r'))
+    image_by_id = {}
+    for image in data['images']:
+        if image['id'] not in image_by_id:
+            image_by_id[image['id']] = (image['file_name'].split('/')[-1][:-4], (image['height'], image['width']))
+
+    # group the annotations by image name, images in the order of their first annotation
+    groups = {}
+    sizes = {}
+    for k, annot in enumerate(data['annotations']):
+        img_name, size = image_by_id[annot['image_id']]
+        if img_name not in groups:
+            groups[img_name] = []
+            sizes[img_name] = size
+        groups[img_name].append(k)
+
+    annots = data['annotations']
+    order = [k for img_name in groups for k in groups[img_name]]
+    # [x, y, width, height] -> [col_min, row_min, col_max, row_max]
+    bbox = np.array([[int(b) for b in annots[k]['bbox']] for k in order], dtype=np.int64).reshape(-1, 4)
+    bbox[:, 2:] += bbox[:, :2]
+    return {'name': np.array(list(groups.keys()), dtype=str),
+            'size': np.array([sizes[img_name] for img_name in groups], dtype=np.int64).reshape(-1, 2),
+            'offset': np.cumsum([0] + [len(group) for group in groups.values()]),
+            'bbox': bbox,
+            'category': np.array([int(annots[k]['category_id']) for k in order], dtype=np.int64)}
+
+
+def load_ground_truth_index(gt_file, use_cache=True):
+    '''
+    Load the ground truth index, cached in gt_file + '.npz' and rebuilt if the ground truth file is newer
+    :return: {image name: {'bboxes': array (n, 4), 'categories': array (n,), 'size': (height, width)}}
+    '''
+    cache_file = gt_file + '.npz'
+    if use_cache and os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(gt_file):
+        with np.load(cache_file) as cache:
+            index = {key: cache[key] for key in cache.files}
+    else:
+        index = build_ground_truth_index(gt_file)
+        if use_cache:
+            np.savez(cache_file, **index)
+
+    ground_truth = {}
+    offset = index['offset']
+    for k, img_name in enumerate(index['name'].tolist()):
+        ground_truth[img_name] = {'bboxes': index['bbox'][offset[k]:offset[k + 1]],
+                                  'categories': index['category'][offset[k]:offset[k + 1]],
+                                  'size': tuple(int(s) for s in index['size'][k])}
+    print('Loading %d ground truth of %d images' % (len(index['category']), len(ground_truth)))
+    return ground_truth
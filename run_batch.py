@@ -1,16 +1,22 @@
 import multiprocessing
 import glob
 import time
-import json
 from tqdm import tqdm
 from os.path import join as pjoin, exists
 import cv2
 
-import detect_compo.ip_region_proposal as ip
+from utils.result_store import ResultStore
+from utils.render import RenderPolicy
+from utils.profiling import SampledProfiler, load_profiles, summarize_profiles, print_profile_summary
+from utils.image_stream import stream_frames
+from utils.pipeline import run_pipeline
 
 
-def resize_height_by_longest_edge(img_path, resize_length=800):
-    org = cv2.imread(img_path)
+def resize_height_by_longest_edge(img, resize_length=800):
+    '''
+    :param img: image path or decoded image
+    '''
+    org = cv2.imread(img) if isinstance(img, str) else img
     height, width = org.shape[:2]
     if height > width:
         return resize_length
@@ -22,10 +28,7 @@ if __name__ == '__main__':
     # initialization
     input_img_root = "E:/Mulong/Datasets/rico/combined"
     output_root = "E:/Mulong/Result/rico/rico_uied/rico_new_uied_v3"
-    data = json.load(open('E:/Mulong/Datasets/rico/instances_test.json', 'r'))
-
-    input_imgs = [pjoin(input_img_root, img['file_name'].split('/')[-1]) for img in data['images']]
-    input_imgs = sorted(input_imgs, key=lambda x: int(x.split('/')[-1][:-4]))  # sorted by index
+    manifest = 'E:/Mulong/Datasets/rico/instances_test.json'
 
     key_params = {'min-grad': 10, 'ffl-block': 5, 'min-ele-area': 50, 'merge-contained-ele': True,
                   'max-word-inline-gap': 10, 'max-line-ingraph-gap': 4, 'remove-top-bar': True}
@@ -34,6 +37,7 @@ if __name__ == '__main__':
     is_clf = False
     is_ocr = False
     is_merge = True
+    ocr_method = 'google'  # or 'paddle' for the offline ocr
 
     # Load deep learning models in advance
     compo_classifier = None
@@ -44,31 +48,39 @@ if __name__ == '__main__':
         compo_classifier['Elements'] = CNN('Elements')
         # compo_classifier['Noise'] = CNN('Noise')
     ocr_model = None
-    if is_ocr:
-        import detect_text.text_detection as text
+    if is_ocr and ocr_method == 'paddle':
+        # one resident model for the whole run
+        from detect_text.ocr import get_paddle_backend
+        ocr_model = get_paddle_backend(lang='ch')
+
+    # all results of the run go to one store, the stages already done for an image are skipped on resume
+    store = ResultStore(pjoin(output_root, 'results.db'))
+    # only a sample of the boards is drawn, the others can be drawn later by run_render.py
+    render = RenderPolicy('sampled', rate=0.01)
+    # per-stage timings and counters of the compo detection of each image, appended as the run goes
+    profile_file = pjoin(output_root, 'profile.jsonl')
+    # cProfile and input of 1 in 100 screens, merged into a flame graph by run_flamegraph.py
+    sampler = SampledProfiler(pjoin(output_root, 'profiles'), every=100)
+    # the merge results packed 1000 per file for the evaluation, result_processing loads them from this directory
+    shard_root = pjoin(output_root, 'merge-shards')
 
     # set the range of target inputs' indices
-    num = 0
     start_index = 30800  # 61728
     end_index = 100000
-    for input_img in input_imgs:
-        resized_height = resize_height_by_longest_edge(input_img)
-        index = input_img.split('/')[-1][:-4]
-        if int(index) < start_index:
-            continue
-        if int(index) > end_index:
-            break
-
-        if is_ocr:
-            text.text_detection(input_img, output_root, show=False)
-
-        if is_ip:
-            ip.compo_detection(input_img, output_root, key_params,  classifier=compo_classifier, resize_by_height=resized_height, show=False)
-
-        if is_merge:
-            import merge
-            compo_path = pjoin(output_root, 'ip', str(index) + '.json')
-            ocr_path = pjoin(output_root, 'ocr', str(index) + '.json')
-            merge.merge(input_img, compo_path, ocr_path, output_root, is_remove_top=key_params['remove-top-bar'], show=True)
-
+    # split the run between machines: each one runs its shard_id out of num_shards
+    shard_id, num_shards = 0, 1
+    # the screens are read lazily in the order of the manifest, the next ones decoded in the background for the compo detection
+    frames = stream_frames(manifest, image_root=input_img_root, shard_id=shard_id, num_shards=num_shards,
+                           select=lambda name: start_index <= int(name) <= end_index, decode=is_ip)
+    # the ocr requests of the next screens are in flight while a screen is detected, each screen is merged once both are done
+    num = 0
+    for name in run_pipeline(frames, output_root, key_params, is_ocr=is_ocr, is_ip=is_ip, is_merge=is_merge, ocr_workers=4,
+                             # one detection thread, the classifier is not shared across threads
+                             ip_workers=1,
+                             max_pending=8, resize=lambda frame: resize_height_by_longest_edge(frame.image if frame.image is not None else frame.path),
+                             store=store, render=render, sampler=sampler, profile_file=profile_file, shard_root=shard_root,
+                             ocr_kwargs={'method': ocr_method, 'paddle_model': ocr_model}, ip_kwargs={'classifier': compo_classifier}, merge_kwargs={'is_remove_bar': key_params['remove-top-bar']}):
         num += 1
+
+    if exists(profile_file):
+        print_profile_summary(summarize_profiles(load_profiles(profile_file)))
@@ -0,0 +1,32 @@
+import sys
+from os.path import exists
+
+from utils.benchmark import run_benchmark, compare_to_baseline, print_benchmark, save_benchmark, load_benchmark
+
+
+if __name__ == '__main__':
+    '''
+        Measure the detection speed over data/input and the synthetic screens and compare it to the stored baseline
+        Run it before a change with update_baseline = True, then after the change to see the regressions
+        Exit status 1 if any metric is slower than the baseline by more than the tolerance
+    '''
+    key_params = {'min-grad': 10, 'ffl-block': 5, 'min-ele-area': 50, 'merge-contained-ele': True}
+    baseline_file = 'logs/benchmark-baseline.json'
+    update_baseline = False
+    tolerance = 0.15
+    repeat = 3
+
+    result = run_benchmark(key_params, repeat=repeat)
+    baseline = load_benchmark(baseline_file) if exists(baseline_file) else None
+    print_benchmark(result, baseline)
+
+    if baseline is None or update_baseline:
+        save_benchmark(baseline_file, result)
+        print('Baseline saved to %s' % baseline_file)
+    else:
+        regressions = compare_to_baseline(result, baseline, tolerance=tolerance)
+        for suite, metric, base_value, value in regressions:
+            print('*** Regression %s %s: %.4f -> %.4f ***' % (suite, metric, base_value, value))
+        if len(regressions) > 0:
+            sys.exit(1)
+        print('No regression over %d%% of the baseline' % int(tolerance * 100))
@@ -0,0 +1,25 @@
+from os.path import join as pjoin
+
+from utils.profiling import load_captures, fold_profiles, save_folded
+
+
+if __name__ == '__main__':
+    '''
+        Merge the cProfile captures of the sampled calls of a run into folded stacks for a flame graph:
+        flamegraph.pl profile-ip.folded > profile-ip.svg, or open the folded file in speedscope
+        stage: 'ip', 'ocr' or 'merge'
+        slowest: only merge the slowest captures, to see what the outliers spend their time on; None for all
+        Each capture directory also keeps the input of the call and its stage timings to reproduce it
+    '''
+    output_root = "E:/Mulong/Result/rico/rico_uied/rico_new_uied_v3"
+    stage = 'ip'
+    slowest = None
+
+    captures = load_captures(pjoin(output_root, 'profiles'), stage)
+    for directory, record in captures[:10]:
+        print('%.3f s %s %s' % (record['wall'], directory, ' '.join('%s:%.3f' % (s, t['wall']) for s, t in record['stages'].items())))
+    if slowest is not None:
+        captures = captures[:slowest]
+    folded = fold_profiles([pjoin(directory, 'profile.prof') for directory, _ in captures], root=stage)
+    save_folded(pjoin(output_root, 'profile-%s.folded' % stage), folded)
+    print('[Flame Graph Input] %d captures Output: %s' % (len(captures), pjoin(output_root, 'profile-%s.folded' % stage)))
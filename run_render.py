@@ -0,0 +1,24 @@
+from os.path import join as pjoin
+
+from utils.result_store import ResultStore
+from utils.element_store import read_shards
+from utils.render import render_results
+
+
+if __name__ == '__main__':
+    '''
+        Draw the boards skipped by the render policy of a run from its stored results
+        source: 'store' for the results.db of run_batch.py, 'shards' for a directory of packed shards
+        stage: 'ip', 'ocr' or 'merge'
+    '''
+    input_img_root = "E:/Mulong/Datasets/rico/combined"
+    output_root = "E:/Mulong/Result/rico/rico_uied/rico_new_uied_v3"
+    source = 'store'
+    stage = 'merge'
+
+    if source == 'store':
+        store = ResultStore(pjoin(output_root, 'results.db'))
+        results = store.iter_results(stage)
+    else:
+        results = read_shards(pjoin(output_root, stage))
+    render_results(results, input_img_root, pjoin(output_root, 'render', stage))
@@ -0,0 +1,22 @@
+import glob
+from os.path import join as pjoin
+
+from utils.param_sweep import ParamSweep
+from result_processing.gt_index import load_ground_truth_index
+
+
+if __name__ == '__main__':
+    '''
+        Tune the compo detection parameters on a subset of the dataset
+        Every stage of an image runs once per distinct value of the parameters it depends on
+    '''
+    input_img_root = "E:/Mulong/Datasets/rico/combined"
+    ground_truth = load_ground_truth_index('E:/Mulong/Datasets/rico/instances_test.json')
+    input_imgs = sorted(glob.glob(pjoin(input_img_root, '*.jpg')), key=lambda x: int(x.replace('\\', '/').split('/')[-1][:-4]))[:200]
+
+    grid = {'min-grad': [4, 6, 8, 10, 12], 'min-ele-area': [25, 50, 100], 'ffl-block': [5, 10],
+            'merge-contained-ele': [True, False]}
+    sweep = ParamSweep(grid)
+    results = sweep.run(input_imgs, ground_truth, no_text=True, workers=4)
+    for config, (precision, recall, f1) in results[:10]:
+        print('Precision:%.3f Recall:%.3f F1:%.3f %s' % (precision, recall, f1, str({key: config[key] for key in grid})))
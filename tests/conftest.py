@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the modules import each other from the repository root, the evaluators from result_processing
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'result_processing')]
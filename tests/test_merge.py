@@ -0,0 +1,28 @@
+from detect_merge.Element import Element
+from detect_merge.merge import check_containment
+
+
+def containment_baseline(elements, bias=(2, 2)):
+    # the smallest enclosing element, of two identical ones the later one
+    parents = {}
+    for k, element in enumerate(elements):
+        enclosing = [j for j, candidate in enumerate(elements) if j != k and element.is_enclosed_by(candidate, bias)
+                     and (candidate.area, j) > (element.area, k)]
+        if enclosing:
+            parents[element.id] = elements[min(enclosing, key=lambda j: (elements[j].area, j))].id
+    return parents
+
+
+def test_check_containment_parent_edge_on_cell_boundary():
+    # the parents end on the last pixel of the first 50 px cell, the children exceed them by up to the bias
+    # and lie in the next cells only
+    elements = [Element(0, (0, 0, 49, 49), 'Compo'),
+                Element(1, (50, 10, 51, 20), 'Compo'),
+                Element(2, (10, 50, 20, 51), 'Compo'),
+                Element(3, (0, 100, 149, 149), 'Compo'),
+                Element(4, (150, 110, 151, 140), 'Compo')]
+    check_containment(elements)
+    parents = {element.id: element.parent_id for element in elements if element.parent_id is not None}
+    assert parents == containment_baseline(elements)
+    assert parents == {1: 0, 2: 0, 4: 3}
+    assert [child.id for child in elements[0].children] == [1, 2]
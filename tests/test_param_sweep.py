@@ -0,0 +1,36 @@
+import os
+from os.path import join as pjoin
+
+import cv2
+import numpy as np
+import pytest
+
+import detect_compo.lib_ip.file_utils as file
+from utils.param_sweep import ParamSweep
+from evaluation import eval, load_detect_result_json
+
+
+def test_sweep_f1_equals_evaluation_f1(tmp_path):
+    # a 1600 px high screen, detected at the default resize-height of 800
+    img = np.full((1600, 720, 3), 255, np.uint8)
+    for x, y, w, h in [(40, 200, 300, 120), (400, 200, 260, 120), (40, 500, 640, 200), (60, 900, 200, 200),
+                       (300, 1000, 120, 60), (40, 1550, 300, 40)]:
+        cv2.rectangle(img, (x, y), (x + w, y + h), (30, 30, 30), 4)
+    img_path = str(tmp_path / '0.jpg')
+    cv2.imwrite(img_path, img)
+    # three boxes of the detection shrunk by 4 at 800 px, a missed one and a text one left out by no_text
+    ground_truth = {'0': {'bboxes': [[52, 212, 328, 308], [412, 212, 648, 308], [44, 506, 674, 696],
+                                     [500, 1200, 700, 1300], [40, 40, 300, 80]],
+                          'categories': [1, 1, 1, 1, 14], 'size': (1600, 720)}}
+
+    sweep = ParamSweep({'min-grad': [10]})
+    (_, (_, _, sweep_f1)), = sweep.run([img_path], ground_truth, no_text=True)
+
+    ip_root = tmp_path / 'ip'
+    os.makedirs(ip_root)
+    file.save_corners_json(pjoin(ip_root, '0.json'), sweep.detect_image(img_path)[0])
+    _, _, f1s = eval(load_detect_result_json(str(ip_root)), ground_truth, str(tmp_path), show=False, no_text=True)
+
+    assert len(f1s) == 1
+    assert 0 < sweep_f1 < 1
+    assert sweep_f1 == pytest.approx(f1s[0])
@@ -0,0 +1,281 @@
+'''
+Benchmark of the detection stages, to measure every performance change before and after
+- inputs: the sample screens of data/input and synthetic dense and tall screens drawn with known text boxes
+- suites: compo detection (per stage, through utils.profiling), the text merge of the ocr results and detect_merge.merge
+- metrics: latency percentiles, throughput, peak traced allocation, gc gen0 collections and the peak RSS of the process
+The result is compared to a stored baseline with a relative tolerance
+'''
+import gc
+import glob
+import json
+import os
+import platform
+import shutil
+import tempfile
+import tracemalloc
+from os.path import join as pjoin
+
+import cv2
+import numpy as np
+
+import detect_compo.ip_region_proposal as ip
+import detect_text.text_detection as text
+import detect_merge.merge as merge
+from detect_text.Text import Text
+from utils.profiling import StageProfiler, summarize_profiles
+from utils.render import RenderPolicy
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the peak RSS is not reported there
+    resource = None
+
+SUITES = ('compo_detection', 'text_merge', 'merge')
+# the metrics compared to the baseline, all lower is better
+COMPARED = ('latency_p50', 'latency_p90', 'peak_alloc_mb', 'gc_gen0')
+WORDS = ['Home', 'Search', 'Settings', 'Profile', 'Sign in', 'Cancel', 'OK', 'Next', 'Share', 'Save', 'Messages',
+         'Notifications', 'Account', 'Privacy', 'Help', 'More', 'Today', 'Recent', 'Favorites', 'Edit']
+
+
+def synthetic_screen(kind, seed=0):
+    '''
+    Draw a synthetic screen of cards holding icons, buttons and text lines
+    :param kind: 'dense': a 1440x800 screen crowded with small elements
+                 'tall': a 5000x1080 full-page screenshot of regular cards
+    :return: (image, words) the words as (content, (left, top, right, bottom)) of the drawn text
+    '''
+    rng = np.random.RandomState(seed)
+    if kind == 'dense':
+        height, width, card_height, columns = 1440, 800, 120, 3
+    elif kind == 'tall':
+        height, width, card_height, columns = 5000, 1080, 220, 1
+    else:
+        raise ValueError('Synthetic screen has to be "dense" or "tall"')
+
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+    words = []
+    card_width = (width - 20) // columns
+    for top in range(10, height - card_height, card_height + 10):
+        for c in range(columns):
+            left = 10 + c * card_width
+            right, bottom = left + card_width - 10, top + card_height
+            cv2.rectangle(img, (left, top), (right, bottom), (200, 200, 200), 2)
+            # an icon on the left and lines of words on its right
+            icon = min(48, card_height // 2)
+            color = tuple(int(v) for v in rng.randint(0, 200, 3))
+            cv2.rectangle(img, (left + 10, top + 10), (left + 10 + icon, top + 10 + icon), color, -1)
+            row = top + 30
+            # leave the bottom free for the button
+            text_bottom = bottom - 45 if card_height >= 100 else bottom - 10
+            while row < text_bottom:
+                col = left + icon + 25
+                for _ in range(rng.randint(1, 4)):
+                    content = WORDS[rng.randint(len(WORDS))]
+                    (w, h), baseline = cv2.getTextSize(content, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 1)
+                    if col + w > right - 10:
+                        break
+                    cv2.putText(img, content, (col, row), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (40, 40, 40), 1)
+                    words.append((content, (col, row - h, col + w, row + baseline)))
+                    col += w + 12
+                row += 28
+            # a button at the bottom right of the card
+            if card_height >= 100:
+                cv2.rectangle(img, (right - 110, bottom - 40), (right - 10, bottom - 10), (255, 140, 0), -1)
+    return img, words
+
+
+def load_inputs(input_root='data/input', ocr_root='data/output/ocr', synthetic=('dense', 'tall')):
+    '''
+    :return: (inputs, synthetic_root) inputs the list of {'name', 'img_path', 'ocr'}, ocr the path of the ocr result
+             json if there is one; the synthetic screens are written to the temporary directory synthetic_root, with
+             their words as ocr result
+    '''
+    inputs = []
+    for img_path in sorted(glob.glob(pjoin(input_root, '*.jpg')) + glob.glob(pjoin(input_root, '*.png'))):
+        name = img_path.replace('\\', '/').split('/')[-1][:-4]
+        ocr = pjoin(ocr_root, name + '.json')
+        inputs.append({'name': name, 'img_path': img_path, 'ocr': ocr if os.path.exists(ocr) else None})
+
+    synthetic_root = tempfile.mkdtemp(prefix='uied-benchmark-input-')
+    for kind in synthetic:
+        img, words = synthetic_screen(kind)
+        name = 'synthetic-' + kind
+        img_path = pjoin(synthetic_root, name + '.png')
+        cv2.imwrite(img_path, img)
+        texts = [Text(i, content, {'left': l, 'top': t, 'right': r, 'bottom': b}) for i, (content, (l, t, r, b)) in enumerate(words)]
+        text.save_detection_json(pjoin(synthetic_root, name + '.json'), texts, img.shape)
+        inputs.append({'name': name, 'img_path': img_path, 'ocr': pjoin(synthetic_root, name + '.json')})
+    return inputs, synthetic_root
+
+
+def load_texts(ocr_file):
+    result = json.load(open(ocr_file, 'r'))
+    return [Text(t['id'], t['content'], {'left': t['column_min'], 'top': t['row_min'], 'right': t['column_max'], 'bottom': t['row_max']})
+            for t in result['texts'] if len(t['content']) > 0]
+
+
+def run_compo_detection(inputs, output_root, uied_params, tile_height=1000):
+    '''
+    Detect the compos of each input, the tall screens are detected strip by strip at the native resolution
+    :return: list of profile records
+    '''
+    records = []
+    for inp in inputs:
+        profiler = StageProfiler(inp['name'])
+        kwargs = {'tile_height': tile_height} if inp['name'] == 'synthetic-tall' else {}
+        ip.compo_detection(inp['img_path'], output_root, dict(uied_params), render=RenderPolicy('none'), profiler=profiler, **kwargs)
+        records.append(profiler.record())
+    return records
+
+
+def run_text_merge(inputs):
+    '''
+    Merge the words of each ocr result into sentences as text_detection does after the ocr
+    '''
+    records = []
+    for inp in inputs:
+        if inp['ocr'] is None:
+            continue
+        profiler = StageProfiler(inp['name'])
+        texts = load_texts(inp['ocr'])
+        with profiler.stage('merge_intersected_texts'):
+            texts = text.merge_intersected_texts(texts)
+        with profiler.stage('text_filter_noise'):
+            texts = text.text_filter_noise(texts)
+        with profiler.stage('text_sentences_recognition'):
+            text.text_sentences_recognition(texts)
+        records.append(profiler.record())
+    return records
+
+
+def run_merge(inputs, output_root):
+    '''
+    Merge the compos detected by run_compo_detection with the ocr result of each input
+    '''
+    records = []
+    for inp in inputs:
+        if inp['ocr'] is None:
+            continue
+        profiler = StageProfiler(inp['name'])
+        with profiler.stage('merge'):
+            merge.merge(inp['img_path'], pjoin(output_root, 'ip', inp['name'] + '.json'), inp['ocr'],
+                        merge_root=pjoin(output_root, 'merge'), is_remove_bar=True, show=False, render=RenderPolicy('none'))
+        records.append(profiler.record())
+    return records
+
+
+def run_suite(suite, inputs, output_root, uied_params):
+    if suite == 'compo_detection':
+        return run_compo_detection(inputs, output_root, uied_params)
+    elif suite == 'text_merge':
+        return run_text_merge(inputs)
+    elif suite == 'merge':
+        return run_merge(inputs, output_root)
+    raise ValueError('Suite has to be one of %s' % str(SUITES))
+
+
+def summarize_suite(runs, memory):
+    '''
+    :param runs: the profile records of each repeat, the latency of an input is its fastest repeat
+    :param memory: (peak traced allocation in bytes, gc gen0 collections) of the traced run
+    '''
+    latency = {}
+    for records in runs:
+        for record in records:
+            latency[record['name']] = min(latency.get(record['name'], record['wall']), record['wall'])
+    values = np.array(list(latency.values()), dtype=np.float64)
+    summary = summarize_profiles([record for records in runs for record in records])
+    result = {'images': len(latency),
+              'latency_p50': float(np.percentile(values, 50)),
+              'latency_p90': float(np.percentile(values, 90)),
+              'latency_max': float(values.max()),
+              'throughput': float(len(values) / values.sum()),
+              'peak_alloc_mb': memory[0] / 2 ** 20,
+              'gc_gen0': memory[1],
+              'stages': {stage: timing['wall']['p50'] for stage, timing in summary['stages'].items()},
+              'slowest': summary['slowest'][:3]}
+    if resource is not None:
+        # the high-water mark of the whole process so far, in KB on Linux
+        result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def run_benchmark(uied_params, suites=SUITES, repeat=3, input_root='data/input', ocr_root='data/output/ocr'):
+    '''
+    Run each suite repeat times for the latency, then once more under tracemalloc for the allocation
+    :return: {'env': versions and machine, 'suites': {suite: metrics}}
+    '''
+    inputs, synthetic_root = load_inputs(input_root, ocr_root)
+    output_root = tempfile.mkdtemp(prefix='uied-benchmark-output-')
+    os.makedirs(pjoin(output_root, 'merge'))
+    result = {'env': {'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+                      'machine': platform.platform(), 'cpus': os.cpu_count()},
+              'params': uied_params, 'repeat': repeat, 'suites': {}}
+    try:
+        for suite in suites:
+            runs = [run_suite(suite, inputs, output_root, uied_params) for _ in range(repeat)]
+
+            gc.collect()
+            gen0 = gc.get_stats()[0]['collections']
+            tracemalloc.start()
+            run_suite(suite, inputs, output_root, uied_params)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            result['suites'][suite] = summarize_suite(runs, (peak, gc.get_stats()[0]['collections'] - gen0))
+    finally:
+        shutil.rmtree(output_root, ignore_errors=True)
+        shutil.rmtree(synthetic_root, ignore_errors=True)
+    return result
+
+
+def compare_to_baseline(result, baseline, tolerance=0.15, min_time=0.002):
+    '''
+    :param tolerance: relative increase over the baseline counted as a regression
+    :param min_time: times (s) below it in the baseline are too noisy to be compared
+    :return: list of regressions (suite, metric, baseline value, current value)
+    '''
+    regressions = []
+    for suite, metrics in result['suites'].items():
+        if suite not in baseline['suites']:
+            continue
+        base = baseline['suites'][suite]
+        compared = [(metric, base.get(metric), metrics.get(metric)) for metric in COMPARED]
+        compared += [('stage:' + stage, base['stages'].get(stage), value) for stage, value in metrics['stages'].items()]
+        for metric, base_value, value in compared:
+            if base_value is None or value is None:
+                continue
+            if (metric.startswith('latency') or metric.startswith('stage')) and base_value < min_time:
+                continue
+            if value > base_value * (1 + tolerance):
+                regressions.append((suite, metric, base_value, value))
+    return regressions
+
+
+def print_benchmark(result, baseline=None):
+    for suite, metrics in result['suites'].items():
+        base = baseline['suites'].get(suite, {}) if baseline is not None else {}
+
+        def delta(metric, value):
+            if metric not in base or base[metric] == 0:
+                return ''
+            return ' (%+.1f%%)' % (100 * (value - base[metric]) / base[metric])
+        print('[Benchmark %s] %d images' % (suite, metrics['images']))
+        for metric in ('latency_p50', 'latency_p90', 'latency_max', 'throughput', 'peak_alloc_mb', 'gc_gen0', 'peak_rss_mb'):
+            if metric in metrics:
+                print('    %-34s %.4f%s' % (metric, metrics[metric], delta(metric, metrics[metric])))
+        for stage, value in metrics['stages'].items():
+            base_stage = base.get('stages', {}).get(stage)
+            change = ' (%+.1f%%)' % (100 * (value - base_stage) / base_stage) if base_stage else ''
+            print('    %-34s %.4f%s' % ('stage ' + stage, value, change))
+    if baseline is not None and baseline['env'] != result['env']:
+        print('*** The baseline was measured in another environment: %s ***' % str(baseline['env']))
+
+
+def save_benchmark(path, result):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    json.dump(result, open(path, 'w'), indent=4)
+
+
+def load_benchmark(path):
+    return json.load(open(path, 'r'))
@@ -0,0 +1,204 @@
+'''
+Columnar storage of detection results
+- the JSON layouts written by compo detection ('ip'), text detection ('ocr') and merge ('merge')
+  are packed into the columns: id, bbox, class, parent, text
+- one .npz holds one or many results, the rows of result k are rows offset[k]:offset[k+1]
+- load_result/save_result pick the format by file extension, .npz for packed and JSON otherwise
+'''
+
+import glob
+import io
+import json
+import os
+from os.path import join as pjoin
+
+import numpy as np
+
+
+def result_kind(result):
+    if 'texts' in result:
+        return 'ocr'
+    if len(result['compos']) > 0 and 'position' in result['compos'][0]:
+        return 'merge'
+    return 'ip'
+
+
+def flatten_nested(compos):
+    flat = []
+    for compo in compos:
+        flat.append(compo)
+        if len(compo.get('children', [])) > 0 and isinstance(compo['children'][0], dict):
+            flat += flatten_nested(compo['children'])
+    return flat
+
+
+def result_rows(result):
+    '''
+    :return: kind, list of (id, bbox, class, parent, text) of the elements in the result
+    '''
+    kind = result_kind(result)
+    rows = []
+    if kind == 'ocr':
+        for text in result['texts']:
+            rows.append((text['id'], (text['column_min'], text['row_min'], text['column_max'], text['row_max']),
+                         'Text', -1, text['content']))
+    elif kind == 'merge':
+        for compo in flatten_nested(result['compos']):
+            pos = compo['position']
+            rows.append((compo['id'], (pos['column_min'], pos['row_min'], pos['column_max'], pos['row_max']),
+                         compo['class'], compo.get('parent', -1), compo.get('text_content')))
+    else:
+        for compo in result['compos']:
+            rows.append((compo['id'], (compo['column_min'], compo['row_min'], compo['column_max'], compo['row_max']),
+                         compo['class'], -1, None))
+    return kind, rows
+
+
+def pack_results(names, results):
+    '''
+    :param names: list of result names, e.g. image names
+    :param results: list of result dicts in the JSON layout
+    :return: dict of column arrays
+    '''
+    kinds, shapes, offset = [], [], [0]
+    ids, bboxes, classes, parents, texts, has_text = [], [], [], [], [], []
+    for result in results:
+        kind, rows = result_rows(result)
+        kinds.append(kind)
+        shapes.append(list(result['img_shape']) + [-1] * (3 - len(result['img_shape'])))
+        offset.append(offset[-1] + len(rows))
+        for ele_id, bbox, cls, parent, text in rows:
+            ids.append(ele_id)
+            bboxes.append(bbox)
+            classes.append(cls)
+            parents.append(parent)
+            texts.append('' if text is None else text)
+            has_text.append(text is not None)
+    return {'name': np.array(names, dtype=str), 'kind': np.array(kinds, dtype=str),
+            'img_shape': np.array(shapes, dtype=np.int32).reshape(-1, 3), 'offset': np.array(offset, dtype=np.int64),
+            'id': np.array(ids, dtype=np.int32), 'bbox': np.array(bboxes, dtype=np.int32).reshape(-1, 4),
+            'class': np.array(classes, dtype=str), 'parent': np.array(parents, dtype=np.int32),
+            'text': np.array(texts, dtype=str), 'has_text': np.array(has_text, dtype=bool)}
+
+
+def unpack_result(columns, k):
+    '''
+    :return: the k-th result rebuilt in its JSON layout (adjacency form for merge results)
+    '''
+    kind = str(columns['kind'][k])
+    start, end = int(columns['offset'][k]), int(columns['offset'][k + 1])
+    img_shape = [int(s) for s in columns['img_shape'][k] if s >= 0]
+    ids = columns['id'][start:end].tolist()
+    bboxes = columns['bbox'][start:end].tolist()
+    classes = columns['class'][start:end].tolist()
+    parents = columns['parent'][start:end].tolist()
+    texts = columns['text'][start:end].tolist()
+    has_text = columns['has_text'][start:end].tolist()
+
+    if kind == 'ocr':
+        output = {'img_shape': img_shape, 'texts': []}
+        for i in range(end - start):
+            col_min, row_min, col_max, row_max = bboxes[i]
+            output['texts'].append({'id': ids[i], 'content': texts[i], 'column_min': col_min, 'row_min': row_min,
+                                    'column_max': col_max, 'row_max': row_max,
+                                    'width': col_max - col_min, 'height': row_max - row_min})
+    elif kind == 'merge':
+        children = {}
+        for i in range(end - start):
+            if parents[i] >= 0:
+                children.setdefault(parents[i], []).append(ids[i])
+        output = {'compos': [], 'img_shape': img_shape}
+        for i in range(end - start):
+            col_min, row_min, col_max, row_max = bboxes[i]
+            c = {'id': ids[i], 'class': classes[i], 'height': row_max - row_min, 'width': col_max - col_min,
+                 'position': {'column_min': col_min, 'row_min': row_min, 'column_max': col_max, 'row_max': row_max}}
+            if has_text[i]:
+                c['text_content'] = texts[i]
+            if ids[i] in children:
+                c['children'] = sorted(children[ids[i]])
+            if parents[i] >= 0:
+                c['parent'] = parents[i]
+            output['compos'].append(c)
+    else:
+        output = {'img_shape': img_shape, 'compos': []}
+        for i in range(end - start):
+            col_min, row_min, col_max, row_max = bboxes[i]
+            output['compos'].append({'id': ids[i], 'class': classes[i], 'column_min': col_min, 'row_min': row_min,
+                                     'column_max': col_max, 'row_max': row_max,
+                                     'width': col_max - col_min, 'height': row_max - row_min})
+    return output
+
+
+def dumps_result(result):
+    '''
+    :return: bytes of the packed .npz of a result
+    '''
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **pack_results([''], [result]))
+    return buffer.getvalue()
+
+
+def loads_result(data):
+    with np.load(io.BytesIO(data)) as columns:
+        return unpack_result(columns, 0)
+
+
+def save_result(file_path, result):
+    if file_path.endswith('.npz'):
+        np.savez_compressed(file_path, **pack_results([''], [result]))
+    else:
+        with open(file_path, 'w') as f_out:
+            json.dump(result, f_out, indent=4)
+
+
+def load_result(file_path):
+    if file_path.endswith('.npz'):
+        with np.load(file_path) as columns:
+            return unpack_result(columns, 0)
+    with open(file_path, 'r') as f_in:
+        return json.load(f_in)
+
+
+class ShardedWriter:
+    '''
+    Write the results of a batch run into packed shards of shard_size results each:
+    root/shard-00000.npz, root/shard-00001.npz, ...
+    '''
+    def __init__(self, root, shard_size=1000):
+        self.root = root
+        self.shard_size = shard_size
+        self.shard_id = len(glob.glob(pjoin(root, 'shard-*.npz')))
+        self.names = []
+        self.results = []
+        os.makedirs(root, exist_ok=True)
+
+    def add(self, name, result):
+        self.names.append(str(name))
+        self.results.append(result)
+        if len(self.results) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.results) == 0:
+            return
+        np.savez_compressed(pjoin(self.root, 'shard-%05d.npz' % self.shard_id), **pack_results(self.names, self.results))
+        self.shard_id += 1
+        self.names = []
+        self.results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
+def read_shards(root):
+    '''
+    :return: generator of (name, result) over all the shards under root
+    '''
+    for shard_path in sorted(glob.glob(pjoin(root, 'shard-*.npz'))):
+        with np.load(shard_path) as shard:
+            columns = {key: shard[key] for key in shard.files}
+        for k, name in enumerate(columns['name'].tolist()):
+            yield name, unpack_result(columns, k)
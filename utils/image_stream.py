@@ -0,0 +1,189 @@
+'''
+Stream the input screens of a run lazily, so a large dataset starts producing results at once in constant memory
+- sources: a directory, a glob pattern, a COCO manifest (.json) or a tar/zip shard of images
+- sharding: shard_id/num_shards split the screens between workers by the hash of their names
+- prefetch: a background thread decodes the next images into a bounded queue while the detection runs
+'''
+import glob
+import json
+import os
+import queue
+import tarfile
+import threading
+import zipfile
+import zlib
+from collections import namedtuple
+from os.path import join as pjoin
+
+import cv2
+import numpy as np
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+# path: file of the image, None for the members of a tar/zip shard
+# image: decoded BGR image, None if the stream does not decode
+Frame = namedtuple('Frame', ['name', 'path', 'image'])
+
+
+def image_name(path):
+    return os.path.splitext(path.replace('\\', '/').split('/')[-1])[0]
+
+
+def is_image(path):
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTS
+
+
+def iter_directory(root, sort=True):
+    '''
+    :param sort: list the file names first to yield in name order, else yield in the order of the file system
+    '''
+    if sort:
+        for file_name in sorted(os.listdir(root)):
+            if is_image(file_name):
+                yield pjoin(root, file_name)
+    else:
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_file() and is_image(entry.name):
+                    yield entry.path
+
+
+def iter_coco_manifest(manifest, image_root):
+    '''
+    Yield the paths of the images of a COCO manifest; the json is parsed whole, only the file names are kept
+    '''
+    file_names = [img['file_name'].split('/')[-1] for img in json.load(open(manifest, 'r'))['images']]
+    seen = set()
+    for file_name in file_names:
+        if file_name not in seen:
+            seen.add(file_name)
+            yield pjoin(image_root, file_name)
+
+
+def iter_archive(archive, keep=None):
+    '''
+    Yield (member name, encoded bytes) of the images of a tar or zip shard, reading the tar as a stream
+    :param keep: function of the image name, the members it rejects are skipped without being read
+    '''
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and is_image(info.filename) and (keep is None or keep(image_name(info.filename))):
+                    yield info.filename, zf.read(info)
+    else:
+        with tarfile.open(archive, 'r|*') as tf:
+            for member in tf:
+                if member.isfile() and is_image(member.name) and (keep is None or keep(image_name(member.name))):
+                    yield member.name, tf.extractfile(member).read()
+
+
+def iter_source(source, image_root=None, sort=True, keep=None):
+    '''
+    :param source: directory, glob pattern, COCO manifest (.json) or tar/zip shard
+    :param image_root: directory of the images of a COCO manifest
+    :param keep: function of the image name deciding if it is yielded
+    :return: iterator of (name, path, encoded bytes), path None for archive members and bytes None for files
+    '''
+    if os.path.isdir(source):
+        paths = iter_directory(source, sort)
+    elif source.endswith('.json'):
+        if image_root is None:
+            raise ValueError('The image_root of the COCO manifest has to be given')
+        paths = iter_coco_manifest(source, image_root)
+    elif os.path.isfile(source) and (zipfile.is_zipfile(source) or tarfile.is_tarfile(source)):
+        return ((image_name(member), None, data) for member, data in iter_archive(source, keep))
+    elif glob.has_magic(source):
+        paths = (path for path in (sorted(glob.iglob(source)) if sort else glob.iglob(source)) if is_image(path))
+    else:
+        raise ValueError('Source has to be a directory, glob pattern, COCO manifest or tar/zip shard: %s' % source)
+    return ((image_name(path), path, None) for path in paths if keep is None or keep(image_name(path)))
+
+
+def in_shard(name, shard_id, num_shards):
+    return zlib.crc32(str(name).encode('utf-8')) % num_shards == shard_id
+
+
+def decode_frame(name, path, data):
+    if data is not None:
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    else:
+        image = cv2.imread(path)
+    if image is None:
+        print('*** Image %s can not be decoded ***' % (path if path is not None else name))
+    return Frame(name, path, image)
+
+
+def prefetch(iterable, depth=8):
+    '''
+    Iterate on a background thread, holding at most depth items ahead of the consumer
+    When the consumer closes the generator or drops it, the thread is stopped and joined, so it is not left inside a
+    decode when the process exits. The thread also stops once the main thread is done, for a generator still open
+    at the exit, e.g. after an error in the consumer's loop; it is not a daemon so the exit waits for its last decode
+    '''
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set() and threading.main_thread().is_alive():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((None, e))
+        put((done, None))
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        # free the queue for a producer blocked on it, then wait for the item it is working on
+        while producer.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        producer.join()
+
+
+def stream_frames(source, image_root=None, shard_id=0, num_shards=1, select=None, decode=True, prefetch_depth=8, sort=True):
+    '''
+    Stream the screens of a source as Frame(name, path, image)
+    :param shard_id, num_shards: only yield the screens of this shard, screens are split by the hash of their name
+    :param select: function of the name deciding if a screen is yielded, e.g. an index range
+    :param decode: decode the images, always on for archive members as they have no path
+    :param prefetch_depth: images decoded ahead on a background thread, 0 to decode in the consumer's thread
+    '''
+    def keep(name):
+        return (num_shards == 1 or in_shard(name, shard_id, num_shards)) and (select is None or select(name))
+
+    def frames():
+        for name, path, data in iter_source(source, image_root, sort, keep):
+            if decode or path is None:
+                frame = decode_frame(name, path, data)
+                if frame.image is None:
+                    continue
+                yield frame
+            else:
+                yield Frame(name, path, None)
+
+    if prefetch_depth > 0:
+        return prefetch(frames(), prefetch_depth)
+    return frames()
@@ -0,0 +1,111 @@
+import itertools
+import time
+
+import detect_compo.lib_ip.ip_preprocessing as pre
+import detect_compo.lib_ip.ip_detection as det
+import detect_compo.lib_ip.Component as Compo
+import detect_compo.lib_ip.file_utils as file
+from detect_compo.ip_region_proposal import refine_compos, nesting_inspection
+from result_processing.detect_results import reform_detect_results, resize_label
+from result_processing.eval_core import score_images, MetricAccumulator
+
+
+class ParamSweep:
+    '''
+    Run compo detection for every configuration of a parameter grid, running each stage once per distinct input:
+    read image (resize-height) -> gradient -> binary map (min-grad) -> components (min-ele-area)
+    -> refined components (merge-contained-ele) -> nested components (ffl-block)
+    The stages of an image are cached while its configurations run and dropped before the next image
+    '''
+    def __init__(self, grid, base_params=None):
+        '''
+        :param grid: {parameter: list of values}, parameters of uied_params and 'resize-height'
+        :param base_params: the uied_params of the parameters not in grid
+        '''
+        self.base_params = {'min-grad': 10, 'ffl-block': 5, 'min-ele-area': 50, 'merge-contained-ele': True,
+                            'resize-height': 800}
+        if base_params is not None:
+            self.base_params.update(base_params)
+        keys = sorted(grid)
+        self.configs = []
+        for values in itertools.product(*[grid[key] for key in keys]):
+            config = dict(self.base_params)
+            config.update(zip(keys, values))
+            self.configs.append(config)
+        self.stage_runs = {}
+
+    def stage(self, cache, key, run):
+        if key not in cache:
+            cache[key] = run()
+            self.stage_runs[key[0]] = self.stage_runs.get(key[0], 0) + 1
+        return cache[key]
+
+    def detect_image(self, img_path):
+        '''
+        :return: list of the components of img_path detected by each configuration, in the order of configs
+        '''
+        cache = {}
+        results = []
+        for config in self.configs:
+            height = config['resize-height']
+            grad_min, min_area = int(config['min-grad']), int(config['min-ele-area'])
+            org, grey = self.stage(cache, ('image', height), lambda: pre.read_img(img_path, height))
+            grad = self.stage(cache, ('gradient', height), lambda: pre.gray_to_gradient(org))
+
+            def binarize():
+                binary = pre.binarize_gradient(grad, grad_min)
+                det.rm_line(binary)
+                return binary
+            binary = self.stage(cache, ('binary', height, grad_min), binarize)
+            compos = self.stage(cache, ('compos', height, grad_min, min_area),
+                                lambda: det.component_detection(binary, min_obj_area=min_area))
+            # later stages modify the components, so they work on copies of the cached ones
+            refined_key = ('refined', height, grad_min, min_area, config['merge-contained-ele'])
+            refined = self.stage(cache, refined_key, lambda: refine_compos(org, binary, Compo.compos_copy(compos), config))
+
+            def nest():
+                nested = Compo.compos_copy(refined)
+                nested += nesting_inspection(org, grey, nested, ffl_block=config['ffl-block'])
+                Compo.compos_update(nested, org.shape)
+                return nested
+            results.append(self.stage(cache, ('nested',) + refined_key[1:] + (config['ffl-block'],), nest))
+        return results
+
+    def run(self, img_paths, ground_truth, no_text=True, workers=None):
+        '''
+        Detect and score every configuration on the images, the compos are filtered, shrunk and rescaled as
+        result_processing.evaluation does with the results it loads
+        :param ground_truth: {image name: {'bboxes', 'categories', 'size'}} of result_processing load_ground_truth_json
+        :param no_text: ignore the text (category 14) ground truth, as compo detection does not detect text
+        :param workers: number of processes scoring the images
+        :return: list of (config, (precision, recall, f1)) sorted by descending f1
+        '''
+        start = time.time()
+        pairs = [{} for _ in self.configs]
+        for img_path in img_paths:
+            name = img_path.replace('\\', '/').split('/')[-1][:-4]
+            if name not in ground_truth:
+                continue
+            gt = ground_truth[name]
+            gt_keep = [k for k, category in enumerate(gt['categories']) if not (no_text and int(category) == 14)]
+            gt_bboxes = [gt['bboxes'][k] for k in gt_keep]
+            gt_categories = [gt['categories'][k] for k in gt_keep]
+            for k, compos in enumerate(self.detect_image(img_path)):
+                # reform_detect_results reads the boxes only, the image shape is not needed
+                detection = reform_detect_results([(name, file.wrap_corners(compos, ()))], shrink=4)
+                # as in the evaluation, an image left without detection is not scored
+                if name not in detection:
+                    continue
+                d_bboxes = resize_label(detection[name]['bboxes'], self.configs[k]['resize-height'], gt['size'][0])
+                pairs[k][name] = (d_bboxes, detection[name]['categories'], gt_bboxes, gt_categories)
+
+        results = []
+        for config, config_pairs in zip(self.configs, pairs):
+            total = MetricAccumulator()
+            for record in score_images(config_pairs, workers=workers).values():
+                total.add(record)
+            results.append((config, total.scores(total.TP, total.FP, total.FN)))
+        results.sort(key=lambda result: -result[1][2])
+        print('[Sweep Completed in %.3f s] %d configurations on %d images, stage runs: %s' % (
+            time.time() - start, len(self.configs), max(len(config_pairs) for config_pairs in pairs), str(self.stage_runs)))
+        return results
@@ -0,0 +1,133 @@
+'''
+Run the stages of a batch overlapped instead of one image after the other
+- decode: utils.image_stream reads and decodes the next screens on a background thread
+- ocr: the OCR round trips of several screens are in flight on their own threads while the compos are detected
+- ip: the compo detection runs on a thread pool, OpenCV and NumPy release the GIL in the heavy steps
+- merge: runs as soon as both the ocr and the ip result of a screen are ready
+The throughput of a batch approaches the slowest of the OCR latency and the detection time rather than their sum
+'''
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from os.path import join as pjoin
+import threading
+
+import detect_compo.ip_region_proposal as ip
+import detect_text.text_detection as text
+import detect_merge.merge as merge
+from utils.profiling import StageProfiler, save_profiles
+from utils.element_store import ShardedWriter
+
+
+def _done(result=None):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _when_both(first, second, submit):
+    '''
+    :param submit: function submitting the next stage once both futures are done, returning its future
+    :return: future of the next stage, it holds the exception of first or second if one failed
+    '''
+    result = Future()
+    remaining = [2]
+    lock = threading.Lock()
+
+    def relay(future):
+        if future.exception() is not None:
+            result.set_exception(future.exception())
+        else:
+            result.set_result(future.result())
+
+    def ready(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        for future in (first, second):
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+                return
+        try:
+            submit().add_done_callback(relay)
+        except Exception as e:
+            result.set_exception(e)
+
+    first.add_done_callback(ready)
+    second.add_done_callback(ready)
+    return result
+
+
+def run_pipeline(frames, output_root, uied_params, is_ocr=True, is_ip=True, is_merge=True, ocr_workers=4, ip_workers=None,
+                 max_pending=8, resize=None, store=None, render=None, sampler=None, profile_file=None, shard_root=None, ocr_kwargs=None,
+                 ip_kwargs=None, merge_kwargs=None):
+    '''
+    :param frames: iterable of utils.image_stream.Frame, the ocr and the merge read the image from its path
+    :param ocr_workers: OCR requests in flight at once
+    :param ip_workers: threads of the compo detection, default as ThreadPoolExecutor
+    :param max_pending: screens submitted and not yet merged, bounds the images held in memory; the decode queue
+                        is set by the prefetch_depth of the stream
+    :param resize: function of the frame giving its resize_by_height for the compo detection, None for the default
+    :param store: utils.result_store.ResultStore; if given the stages already done for a screen are skipped
+    :param profile_file: if given, the profile record of the compo detection of each screen is appended to it
+    :param shard_root: if given, the merge results are also packed into the shards of a utils.element_store.ShardedWriter
+                       under it, the evaluators of result_processing read them back
+    :param ocr_kwargs, ip_kwargs, merge_kwargs: other arguments of text_detection, compo_detection and merge
+    :return: iterator of the names of the screens once processed, in the order of frames
+    '''
+    ocr_kwargs, ip_kwargs, merge_kwargs = ocr_kwargs or {}, ip_kwargs or {}, merge_kwargs or {}
+    if store is None:
+        for stage in ('ocr', 'ip', 'merge'):
+            os.makedirs(pjoin(output_root, stage), exist_ok=True)
+
+    profile_lock = threading.Lock()
+
+    def todo(name, stage):
+        return store is None or not store.has(name, stage)
+
+    def detect_text(frame):
+        text.text_detection(frame.path, output_root, show=False, store=store, render=render, sampler=sampler, **ocr_kwargs)
+
+    def detect_compos(frame):
+        image = frame.image if frame.image is not None else frame.path
+        kwargs = dict(ip_kwargs, resize_by_height=resize(frame)) if resize is not None else ip_kwargs
+        profiler = StageProfiler(frame.name) if profile_file is not None else None
+        ip.compo_detection(image, output_root, dict(uied_params), name=frame.name, show=False, store=store, render=render,
+                           profiler=profiler, sampler=sampler, **kwargs)
+        if profiler is not None:
+            with profile_lock:
+                save_profiles(profile_file, [profiler.record()])
+
+    def merge_results(frame):
+        compo_path = pjoin(output_root, 'ip', frame.name + '.json') if store is None else None
+        text_path = pjoin(output_root, 'ocr', frame.name + '.json') if store is None else None
+        _, components = merge.merge(frame.path, compo_path, text_path, merge_root=pjoin(output_root, 'merge'), show=False,
+                                    store=store, render=render, sampler=sampler, **merge_kwargs)
+        # the merge runs on one thread, the writer is not shared
+        if writer is not None:
+            writer.add(frame.name, components)
+        return frame.name
+
+    writer = ShardedWriter(shard_root) if shard_root is not None else None
+    try:
+        # the merge pool is shut down last as the other stages submit to it when they finish
+        with ThreadPoolExecutor(max_workers=1) as merge_pool, ThreadPoolExecutor(max_workers=ocr_workers) as ocr_pool, \
+                ThreadPoolExecutor(max_workers=ip_workers) as ip_pool:
+            pending = []
+            for frame in frames:
+                if frame.path is None and (is_ocr or is_merge):
+                    raise ValueError('The ocr and the merge have to read the image from a path: %s' % frame.name)
+                ocr_future = ocr_pool.submit(detect_text, frame) if is_ocr and todo(frame.name, 'ocr') else _done()
+                ip_future = ip_pool.submit(detect_compos, frame) if is_ip and todo(frame.name, 'ip') else _done()
+                if is_merge and todo(frame.name, 'merge'):
+                    pending.append(_when_both(ocr_future, ip_future, lambda frame=frame: merge_pool.submit(merge_results, frame)))
+                else:
+                    pending.append(_when_both(ocr_future, ip_future, lambda frame=frame: _done(frame.name)))
+                if len(pending) >= max_pending:
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+    finally:
+        # the last partial shard
+        if writer is not None:
+            writer.flush()
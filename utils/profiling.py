@@ -0,0 +1,331 @@
+import cProfile
+import glob
+import json
+import os
+import pstats
+import shutil
+import time
+import tracemalloc
+import zlib
+from contextlib import contextmanager
+from os.path import join as pjoin
+
+import cv2
+import numpy as np
+
+from utils.element_store import save_result
+
+
+class StageProfiler:
+    '''
+    Per-stage timing and counters of the detection of one image
+    - stage(name): wall time and cpu time of the calling thread spent in the with-block, summed over repeated entries
+    - count(name, n): add n to a counter, e.g. seeds visited or compos left after a filter
+    The cpu time is per thread, so images detected in parallel threads do not see each other's work
+    With trace_memory, each stage also records through tracemalloc:
+    - peak_mb: peak of the traced allocations during the stage
+    - net_mb: allocations still alive after the stage, minus the freed ones
+    - numpy_mb: NumPy buffers alive after the stage
+    and the top allocation sites are kept from the end of the stage holding the most memory
+    Tracing slows the detection down and counts the allocations of the whole process, so trace one image at a time
+    and do not nest the stages; record() or close() stops the tracing this profiler started
+    '''
+    def __init__(self, name=None, trace_memory=False, top=10):
+        self.name = name
+        self.stages = {}
+        self.counters = {}
+        self.trace_memory = trace_memory
+        self.top = top
+        self.memory = {}
+        self.top_allocations = []
+        self.live_max = -1
+        # the stages are traced until close(), tracemalloc is only stopped there if this profiler started it
+        self.tracing = trace_memory
+        self.started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, stage):
+        wall, cpu = time.perf_counter(), time.thread_time()
+        tracing = self.tracing
+        if tracing:
+            traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        try:
+            yield self
+        finally:
+            timing = self.stages.setdefault(stage, {'wall': 0.0, 'cpu': 0.0})
+            timing['wall'] += time.perf_counter() - wall
+            timing['cpu'] += time.thread_time() - cpu
+            if tracing and self.tracing:
+                self.trace_stage_memory(stage, traced)
+
+    def trace_stage_memory(self, stage, traced):
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        numpy_traces = snapshot.filter_traces([tracemalloc.DomainFilter(True, np.lib.tracemalloc_domain)])
+        memory = self.memory.setdefault(stage, {'peak_mb': 0.0, 'net_mb': 0.0, 'numpy_mb': 0.0})
+        memory['peak_mb'] = max(memory['peak_mb'], peak / 2 ** 20)
+        memory['net_mb'] += (current - traced) / 2 ** 20
+        memory['numpy_mb'] = sum(trace.size for trace in numpy_traces.traces) / 2 ** 20
+        if current > self.live_max:
+            self.live_max = current
+            self.top_allocations = [(str(stat.traceback[0]), stat.size / 2 ** 20, stat.count)
+                                    for stat in snapshot.statistics('lineno')[:self.top]]
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + int(n)
+
+    def close(self):
+        '''
+        Stop tracing the stages, and stop tracemalloc if this profiler started it
+        '''
+        self.tracing = False
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def record(self):
+        '''
+        Closes the profiler, see close()
+        :return: {'name', 'wall': total wall time, 'stages': {stage: {'wall', 'cpu'}}, 'counters': {counter: value}}
+                 with trace_memory, also 'memory': {stage: {'peak_mb', 'net_mb', 'numpy_mb'}} and
+                 'top_allocations': [(file:line, size_mb, count)]
+        '''
+        self.close()
+        record = {'name': self.name, 'wall': sum(timing['wall'] for timing in self.stages.values()),
+                  'stages': {stage: dict(timing) for stage, timing in self.stages.items()},
+                  'counters': dict(self.counters)}
+        if self.trace_memory:
+            record['memory'] = {stage: dict(memory) for stage, memory in self.memory.items()}
+            record['top_allocations'] = list(self.top_allocations)
+        return record
+
+
+def profile_count(profiler, counter, n=1):
+    '''
+    :param profiler: StageProfiler or None for no profiling
+    '''
+    if profiler is not None:
+        profiler.count(counter, n)
+
+
+def profile_stage(profiler, name):
+    '''
+    :param profiler: StageProfiler or None for no profiling
+    '''
+    return profiler.stage(name) if profiler is not None else _no_stage()
+
+
+@contextmanager
+def _no_stage():
+    yield None
+
+
+class SampledProfiler:
+    '''
+    Profile 1 in every N calls of the pipeline entry points with cProfile, for the slow screens of production runs
+    The calls are picked by the hash of the screen name, as RenderPolicy 'sampled', so a screen is profiled in
+    every run and stage or in none, and a slow one is profiled again when rerun
+    Each capture goes to root/<stage>/<name>/:
+    - profile.prof: the cProfile stats, readable by pstats or snakeviz
+    - record.json: the stage timings and counters of StageProfiler, with 'wall' the time of the whole call
+    - the inputs of the call (image, or compo and text results for merge) to reproduce it
+    '''
+    def __init__(self, root, every=100, capture_input=True):
+        self.root = root
+        self.every = every
+        self.capture_input = capture_input
+
+    def should_profile(self, name):
+        return zlib.crc32(str(name).encode('utf-8')) % self.every == 0
+
+
+class Capture:
+    def __init__(self, sampler, name, stage):
+        self.directory = pjoin(sampler.root, stage, str(name))
+        self.capture_input = sampler.capture_input
+        self.stage = stage
+        self.profiler = StageProfiler(name)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        self.start = time.perf_counter()
+
+    def finish(self, inputs=(), record_profiler=None):
+        '''
+        :param inputs: input files (path), images (numpy) or results (dict) of the call, kept if the sampler captures inputs
+        :param record_profiler: the StageProfiler of the call if it was given another than the capture's one
+        '''
+        self.profile.disable()
+        wall = time.perf_counter() - self.start
+        os.makedirs(self.directory, exist_ok=True)
+        self.profile.dump_stats(pjoin(self.directory, 'profile.prof'))
+        record = (record_profiler or self.profiler).record()
+        record['stage'] = self.stage
+        record['wall'] = wall
+        record['inputs'] = []
+        if self.capture_input:
+            for k, inp in enumerate(inputs):
+                if isinstance(inp, str):
+                    path = pjoin(self.directory, 'input-%d-%s' % (k, os.path.basename(inp)))
+                    shutil.copy(inp, path)
+                elif isinstance(inp, dict):
+                    path = pjoin(self.directory, 'input-%d.json' % k)
+                    save_result(path, inp)
+                else:
+                    path = pjoin(self.directory, 'input-%d.png' % k)
+                    cv2.imwrite(path, inp)
+                record['inputs'].append(os.path.basename(path))
+        json.dump(record, open(pjoin(self.directory, 'record.json'), 'w'), indent=4)
+
+
+def start_capture(sampler, name, stage):
+    '''
+    :param sampler: SampledProfiler or None for no sampling
+    :return: the Capture profiling this call, None if the call is not sampled
+    '''
+    if sampler is None or not sampler.should_profile(name):
+        return None
+    try:
+        return Capture(sampler, name, stage)
+    except ValueError:
+        # another profiler is active, e.g. a sampled call of another thread
+        print('*** Profile of %s [%s] skipped, another profiler is active ***' % (name, stage))
+        return None
+
+
+def finish_capture(capture, inputs=(), record_profiler=None):
+    if capture is not None:
+        capture.finish(inputs, record_profiler)
+
+
+def fold_profiles(prof_files, root=None, max_depth=64):
+    '''
+    Merge cProfile captures into folded stacks, the input of flamegraph.pl, speedscope or inferno
+    cProfile keeps caller -> callee totals rather than whole stacks, so the time of a function is split over
+    the paths reaching it in proportion to the time each caller spent in it
+    :param root: frame put at the bottom of every stack, e.g. the stage of the captures
+    :return: {'caller;...;function': microseconds of self time}
+    '''
+    stats = pstats.Stats(*prof_files)
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, caller_ct) in callers.items():
+            callees.setdefault(caller, []).append((func, caller_ct))
+
+    def label(func):
+        filename, line, func_name = func
+        return '%s:%s' % (os.path.basename(filename), func_name) if filename != '~' else func_name.strip('<>')
+
+    folded = {}
+
+    def walk(func, stack, share):
+        _, _, tt, ct, _ = stats.stats[func]
+        stack = stack + [label(func).replace(';', ',')]
+        key = ';'.join(stack)
+        folded[key] = folded.get(key, 0) + tt * share * 1e6
+        if len(stack) >= max_depth:
+            return
+        for callee, edge_ct in callees.get(func, []):
+            callee_ct = stats.stats[callee][3]
+            if callee_ct > 0 and label(callee) not in stack:
+                walk(callee, stack, share * edge_ct / callee_ct)
+
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if len(callers) == 0:
+            walk(func, [root] if root is not None else [], 1.0)
+    return {key: int(value) for key, value in folded.items() if value >= 1}
+
+
+def save_folded(path, folded):
+    with open(path, 'w') as f:
+        for stack, value in sorted(folded.items()):
+            f.write('%s %d\n' % (stack, value))
+
+
+def load_captures(root, stage=None):
+    '''
+    :return: list of (capture directory, record) under the root of a SampledProfiler, slowest first
+    '''
+    captures = []
+    for record_file in glob.glob(pjoin(root, stage if stage is not None else '*', '*', 'record.json')):
+        captures.append((os.path.dirname(record_file), json.load(open(record_file, 'r'))))
+    return sorted(captures, key=lambda capture: -capture[1]['wall'])
+
+
+def save_profiles(path, records):
+    '''
+    Append the profile records to a JSON-lines file
+    '''
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def load_profiles(path):
+    return [json.loads(line) for line in open(path, 'r') if line.strip()]
+
+
+def summarize_profiles(records, percentiles=(50, 90, 99), top=5):
+    '''
+    Aggregate profile records into percentiles of each stage time and counter, and list the slowest images
+    :return: {'images', 'stages': {stage: {'wall': {p: value}, 'cpu': {p: value}}}, 'counters': {counter: {p: value}},
+              'slowest': [(name, wall)]}, and 'memory': {stage: {p: peak_mb}} if the records traced the memory
+    '''
+    def distribution(values):
+        values = np.array(values, dtype=np.float64)
+        percentile = {'p%d' % p: float(np.percentile(values, p)) for p in percentiles}
+        percentile['max'] = float(values.max())
+        return percentile
+
+    stages, counters, memory = {}, {}, {}
+    for record in records:
+        for stage_name, stage_memory in record.get('memory', {}).items():
+            memory.setdefault(stage_name, []).append(stage_memory['peak_mb'])
+        for stage_name, timing in record['stages'].items():
+            stages.setdefault(stage_name, {'wall': [], 'cpu': []})
+            stages[stage_name]['wall'].append(timing['wall'])
+            stages[stage_name]['cpu'].append(timing['cpu'])
+        for counter, value in record['counters'].items():
+            counters.setdefault(counter, []).append(value)
+
+    slowest = sorted(records, key=lambda record: -record['wall'])[:top]
+    summary = {'images': len(records),
+               'stages': {stage_name: {'wall': distribution(timing['wall']), 'cpu': distribution(timing['cpu'])}
+                          for stage_name, timing in stages.items()},
+               'counters': {counter: distribution(values) for counter, values in counters.items()},
+               'slowest': [(record['name'], record['wall']) for record in slowest]}
+    if len(memory) > 0:
+        summary['memory'] = {stage_name: distribution(peaks) for stage_name, peaks in memory.items()}
+    return summary
+
+
+def print_profile_summary(summary):
+    print('[Profile of %d images] wall/cpu time (s) per stage' % summary['images'])
+    for stage_name, timing in summary['stages'].items():
+        print('    %-26s wall %s  cpu %s' % (stage_name, _format(timing['wall'], '%.3f'), _format(timing['cpu'], '%.3f')))
+    print('  counters per image')
+    for counter, values in summary['counters'].items():
+        print('    %-26s %s' % (counter, _format(values, '%d')))
+    if 'memory' in summary:
+        print('  peak traced MB per stage')
+        for stage_name, peaks in summary['memory'].items():
+            print('    %-26s %s' % (stage_name, _format(peaks, '%.1f')))
+    print('  slowest: ' + ', '.join('%s (%.3f s)' % (name, wall) for name, wall in summary['slowest']))
+
+
+def _format(summary, number_format):
+    return ' '.join(('%s:' + number_format) % (key, value) for key, value in summary.items())
+
+
+def print_memory_report(record):
+    '''
+    Print the memory of each stage and the top allocation sites of a record traced with trace_memory
+    '''
+    print('[Memory of %s] traced MB per stage' % record['name'])
+    for stage_name, memory in record['memory'].items():
+        print('    %-26s peak:%.1f net:%+.1f numpy:%.1f' % (stage_name, memory['peak_mb'], memory['net_mb'], memory['numpy_mb']))
+    print('  top allocations')
+    for site, size, count in record['top_allocations']:
+        print('    %8.2f MB %8d blocks  %s' % (size, count, site))
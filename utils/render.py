@@ -0,0 +1,75 @@
+import os
+import zlib
+from os.path import join as pjoin
+
+import cv2
+
+from utils.element_store import result_kind, result_rows
+
+# colors of the boards drawn by each stage
+STAGE_COLOR = {'ip': (0, 255, 0), 'ocr': (0, 0, 255)}
+MERGE_COLOR = {'Text': (0, 0, 255), 'Compo': (0, 255, 0), 'Block': (0, 255, 0), 'Text Content': (255, 0, 255)}
+
+
+class RenderPolicy:
+    '''
+    Decide which images get their visualization boards drawn and encoded
+    - 'all': every image, as without a policy
+    - 'none': no image
+    - 'on-error': only the images where the stage found no element
+    - 'sampled': a fraction rate of the images, picked by the hash of the image name so reruns pick the same ones
+    Skipped boards can be drawn later from the stored results by render_results
+    '''
+    MODES = ('none', 'on-error', 'sampled', 'all')
+
+    def __init__(self, mode='all', rate=0.05):
+        if mode not in self.MODES:
+            raise ValueError('Render mode has to be one of %s' % str(self.MODES))
+        self.mode = mode
+        self.rate = rate
+
+    def should_render(self, name, error=False):
+        if self.mode == 'all':
+            return True
+        if self.mode == 'none':
+            return False
+        if self.mode == 'on-error':
+            return error
+        return zlib.crc32(str(name).encode('utf-8')) % 10000 < self.rate * 10000
+
+
+def should_render(render, name, error=False):
+    '''
+    :param render: RenderPolicy or None for rendering all
+    '''
+    return render is None or render.should_render(name, error)
+
+
+def draw_result(img, result, line=2):
+    '''
+    Draw the elements of an ip, ocr or merge result on the image resized to the result's img_shape
+    '''
+    kind, rows = result_kind(result), result_rows(result)[1]
+    board = cv2.resize(img, (result['img_shape'][1], result['img_shape'][0]))
+    for _, bbox, cls, _, _ in rows:
+        color = MERGE_COLOR.get(cls, (0, 255, 0)) if kind == 'merge' else STAGE_COLOR[kind]
+        cv2.rectangle(board, (bbox[0], bbox[1]), (bbox[2], bbox[3]), color, line)
+    return board
+
+
+def render_results(results, input_img_root, output_dir, input_ext='.jpg', board_ext='.jpg'):
+    '''
+    Draw the boards of stored results afterwards
+    :param results: iterable of (image name, result), e.g. ResultStore.iter_results(stage) or read_shards(root)
+    :param input_img_root: directory of the input images, named as the results
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    num = 0
+    for name, result in results:
+        img = cv2.imread(pjoin(input_img_root, name + input_ext))
+        if img is None:
+            print('*** Input image of %s not found in %s ***' % (name, input_img_root))
+            continue
+        cv2.imwrite(pjoin(output_dir, name + board_ext), draw_result(img, result))
+        num += 1
+    print('[Render Completed] %d boards Output: %s' % (num, output_dir))
@@ -0,0 +1,81 @@
+import sqlite3
+import threading
+
+import cv2
+import numpy as np
+
+from utils.element_store import dumps_result, loads_result
+
+
+class ResultStore:
+    '''
+    Run-level store of the results of all stages in one SQLite file, keyed by (image name, stage)
+    - stages: 'ip' (compo detection), 'ocr' (text detection), 'merge'
+    - a result is kept in the packed element format, its visualization as encoded image bytes
+    - has() tells the stages already done for resuming a run, iter_results() streams a stage in name order
+    '''
+    def __init__(self, db_path, save_boards=True, board_ext='.jpg'):
+        self.db_path = db_path
+        self.save_boards = save_boards
+        self.board_ext = board_ext
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS results (name TEXT NOT NULL, stage TEXT NOT NULL, '
+                          'result BLOB NOT NULL, board BLOB, PRIMARY KEY (name, stage))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS results_stage ON results (stage, name)')
+        self.conn.commit()
+
+    def put(self, name, stage, result, board=None):
+        '''
+        :param result: result dict in the JSON layout of the stage
+        :param board: visualization image, dropped if save_boards is False
+        '''
+        board_data = None
+        if board is not None and self.save_boards:
+            board_data = cv2.imencode(self.board_ext, board)[1].tobytes()
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                              (str(name), stage, dumps_result(result), board_data))
+            self.conn.commit()
+
+    def get(self, name, stage):
+        with self.lock:
+            row = self.conn.execute('SELECT result FROM results WHERE name = ? AND stage = ?', (str(name), stage)).fetchone()
+        return None if row is None else loads_result(row[0])
+
+    def get_board(self, name, stage):
+        with self.lock:
+            row = self.conn.execute('SELECT board FROM results WHERE name = ? AND stage = ?', (str(name), stage)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return cv2.imdecode(np.frombuffer(row[0], np.uint8), cv2.IMREAD_COLOR)
+
+    def has(self, name, stage):
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM results WHERE name = ? AND stage = ?', (str(name), stage)).fetchone()
+        return row is not None
+
+    def names(self, stage):
+        with self.lock:
+            return [row[0] for row in self.conn.execute('SELECT name FROM results WHERE stage = ? ORDER BY name', (stage,))]
+
+    def iter_results(self, stage, batch_size=500):
+        '''
+        :return: generator of (name, result) of a stage, read batch_size rows at a time
+        '''
+        last_name = ''
+        while True:
+            with self.lock:
+                rows = self.conn.execute('SELECT name, result FROM results WHERE stage = ? AND name > ? ORDER BY name LIMIT ?',
+                                         (stage, last_name, batch_size)).fetchall()
+            if len(rows) == 0:
+                return
+            for name, data in rows:
+                yield name, loads_result(data)
+            last_name = rows[-1][0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
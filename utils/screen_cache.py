@@ -0,0 +1,126 @@
+import pickle
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def phash(img, hash_size=8, highfreq_factor=4):
+    '''
+    Perceptual hash of a screenshot: DCT of the downscaled grey image thresholded by its median
+    :param img: BGR/BGRA/grey image or image path
+    :param hash_size: the hash has hash_size * hash_size bits
+    :return: int
+    '''
+    if isinstance(img, str):
+        img = cv2.imread(img)
+    if len(img.shape) == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+    size = hash_size * highfreq_factor
+    small = cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(small)[:hash_size, :hash_size]
+    bits = (low_freq > np.median(low_freq)).flatten()
+    return int(np.packbits(bits).tobytes().hex(), 16)
+
+
+def hamming_distance(hash_a, hash_b):
+    return bin(hash_a ^ hash_b).count('1')
+
+
+class ScreenCache:
+    '''
+    Cache of detection results keyed by the perceptual hash of the screenshot
+    - a screen matches an entry if they share tag and image shape and their hashes differ by at most max_distance bits
+    - entries are kept pickled and evicted in LRU order once their total size exceeds max_bytes
+    '''
+    def __init__(self, max_distance=4, max_bytes=64 * 1024 * 1024, hash_size=8):
+        self.max_distance = max_distance
+        self.max_bytes = max_bytes
+        self.hash_size = hash_size
+
+        self.entries = OrderedDict()    # (tag, shape, hash) -> pickled result
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def screen_key(self, img, tag=''):
+        if isinstance(img, str):
+            img = cv2.imread(img)
+        return tag, tuple(img.shape[:2]), phash(img, self.hash_size)
+
+    def find(self, key):
+        '''
+        :return: the key of the closest cached screen within max_distance, or None
+        '''
+        if key in self.entries:
+            return key
+        if self.max_distance <= 0:
+            return None
+        tag, shape, hash_value = key
+        best_key, best_dist = None, self.max_distance + 1
+        for cached in self.entries:
+            if cached[0] != tag or cached[1] != shape:
+                continue
+            dist = hamming_distance(cached[2], hash_value)
+            if dist < best_dist:
+                best_key, best_dist = cached, dist
+        return best_key
+
+    def get(self, key):
+        with self.lock:
+            cached = self.find(key)
+            if cached is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(cached)
+            self.hits += 1
+            data = self.entries[cached]
+        return pickle.loads(data)
+
+    def put(self, key, result):
+        data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= len(self.entries.pop(key))
+            self.entries[key] = data
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+    def get_or_detect(self, img, detect, tag=''):
+        '''
+        Return the cached result of a known screen, otherwise run detect(img) and cache its result
+        :param detect: function taking img and returning the (picklable) element list
+        '''
+        key = self.screen_key(img, tag)
+        result = self.get(key)
+        if result is None:
+            result = detect(img)
+            if result is not None:
+                self.put(key, result)
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def default_cache():
+    '''
+    Process-wide cache shared by the detection entry points
+    '''
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ScreenCache()
+    return _default_cache
@@ -7,8 +7,11 @@ from appium import webdriver
 from appium.options.ios import XCUITestOptions
 from ultralytics import YOLO
 
+from utils.screen_cache import default_cache
+
 # Load YOLOv8 model (replace with a UI-trained model if available)
 model = YOLO("yolov8n.pt")
+screen_cache = default_cache()
 
 
 def start_appium():
@@ -46,22 +49,25 @@ def capture_screenshot():
 
 
 def detect_ui_elements(image_path):
+    def detect(img):
+        results = model(img, imgsz=(1184, 2560), visualize=False)
+        ui_elements = []
+
+        for result in results:
+            for box in result.boxes:
+                x1, y1, x2, y2 = map(int, box.xyxy[0])
+                confidence = box.conf[0].item()
+                class_id = int(box.cls[0])
+                label = f"Element {class_id}"  # Replace with actual class mapping if available
+                ui_elements.append({
+                    "bbox": [x1, y1, x2, y2],
+                    "label": label,
+                    "confidence": confidence
+                })
+        return ui_elements
+
     image = cv2.imread(image_path)
-    results = model(image, imgsz=(1184, 2560), visualize=False)
-    ui_elements = []
-
-    for result in results:
-        for box in result.boxes:
-            x1, y1, x2, y2 = map(int, box.xyxy[0])
-            confidence = box.conf[0].item()
-            class_id = int(box.cls[0])
-            label = f"Element {class_id}"  # Replace with actual class mapping if available
-            ui_elements.append({
-                "bbox": [x1, y1, x2, y2],
-                "label": label,
-                "confidence": confidence
-            })
-    return ui_elements
+    return screen_cache.get_or_detect(image, detect, tag='yolo')
 
 
 def find_element_by_label(label, ui_elements):